@@ -0,0 +1,91 @@
+import json
+import os
+import re
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from ReportGen.instrument import Recorder, recording, write_run_manifest
+from ReportGen.parallel import map_partitions
+from ReportGen.ppt import Template
+from ReportGen.render import RenderCache
+from ReportGen.report import build_report
+from ReportGen.spec import load_spec
+from ReportGen.state import GROUPINGS, segment_aggregates
+
+
+MANIFEST = 'manifest.json'
+
+
+def segment_file(by, value):
+    slug = re.sub(r'[^\w-]+', '_', str(value)).strip('_')
+    return 'report_{}_{}.pptx'.format(by.lower(), slug)
+
+
+def build_segment(task, template, spec, native_charts=False, cache_dir=None, instrument=None):
+    by, value, agg, out_path = task
+    start = time.perf_counter()
+    recorder = Recorder(**instrument) if instrument else None
+    with recording(recorder) if recorder else nullcontext():
+        built = build_report(agg, out_path, template,
+                             label='{} - {}'.format(spec['label'], value),
+                             native_charts=native_charts, workers=1,
+                             cache=RenderCache(cache_dir) if cache_dir else None, spec=spec)
+    report = {'segment': by, 'value': str(value), 'path': out_path, 'slides': built['slides'],
+              'bytes': os.path.getsize(out_path), 'images': built['images'],
+              'seconds': round(time.perf_counter() - start, 3)}
+    if recorder:
+        report['run_manifest'] = write_run_manifest(
+            recorder, out_path, segment=by, value=str(value))
+    return report
+
+
+def write_manifest(out_dir, reports):
+    manifest = {'generated': datetime.now().isoformat(timespec='seconds'),
+                'reports': reports}
+    path = os.path.join(out_dir, MANIFEST)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def check_segments(segments):
+    # top N segments are ranked by the net sales Aggregates keep per column
+    ranked = [by for by, values in segments.items()
+              if isinstance(values, int) and by not in GROUPINGS]
+    if ranked:
+        raise ValueError('Cannot rank segments by {}; top N needs one of {}'.format(
+            ', '.join(ranked), ', '.join(GROUPINGS)))
+
+
+# One deck per segment from a single load of the data. segments maps a column
+# to the values to report on: a list, None for every value, or an int for the
+# top N by net sales in total (the Aggregates of the whole dataset). Decks
+# are built on a process pool from one parsed copy of the template and
+# listed in out_dir/manifest.json, whose path is returned. spec is the report
+# spec every deck follows (report.json by default). instrument takes
+# instrument.Recorder options to write a run manifest next to every deck.
+def build_reports(file_root, mapper, segments, out_dir, template_path, total=None, workers=None, use_cache=True, native_charts=False, cache_dir=None, instrument=None, spec=None):
+    check_segments(segments)
+    wanted = {}
+    for by, values in segments.items():
+        if isinstance(values, int):
+            values = total.top_keys(by, top=values)
+        wanted[by] = values
+    parts = segment_aggregates(
+        file_root, mapper, wanted, workers=workers, use_cache=use_cache)
+
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = []
+    for by, values in wanted.items():
+        if values is None:
+            values = sorted(value for key, value in parts if key == by)
+        tasks += [(by, value, parts[(by, value)], os.path.join(out_dir, segment_file(by, value)))
+                  for value in values if (by, value) in parts]
+
+    template = Template(template_path)
+    spec = spec or load_spec()
+    reports = map_partitions(build_segment, tasks, template, spec, native_charts, cache_dir,
+                             instrument, workers=workers)
+    return write_manifest(out_dir, reports)
@@ -0,0 +1,264 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from ReportGen.cache import CACHE_DIR, ColumnarCache
+from ReportGen.parallel import tree_reduce
+from ReportGen.prep import attach_mapper, compact_frame, consolidate_data, data_files, generate_features, read_workbook
+from ReportGen.render import render_job
+from ReportGen.spec import ReportGraph, assemble_slides, deck_slides, load_spec, slide_needs
+from ReportGen.state import Aggregates
+
+
+BENCH_DIR = 'bench'
+RESULTS_FILE = 'results.jsonl'
+# rows per generated worksheet; Excel stops at 1,048,576
+SHEET_ROWS = 1000000
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_rows(text):
+    # '10k', '2.5m' or a plain count
+    text = str(text).strip().lower()
+    scale = {'k': 10 ** 3, 'm': 10 ** 6}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+# Wall and CPU seconds of each named stage, in the order the stages first
+# ran; a stage entered again adds to its total. Used as the stage argument
+# of spec.ReportGraph.compute.
+class Timings():
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def __call__(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            stage['wall'] += time.perf_counter() - wall
+            stage['cpu'] += time.process_time() - cpu
+
+
+@contextmanager
+def _cwd(path):
+    # prep and state find data/ from the working directory
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(old)
+
+
+def _zipf_weights(n, a=1.0):
+    w = 1 / np.arange(1, n + 1) ** a
+    return w / w.sum()
+
+
+def synth_mapper(products, classes, rng):
+    # a few large classes and a long tail of small ones, like the real map
+    names = np.array(['Product {:07d}'.format(i) for i in range(products)], dtype=object)
+    cls = rng.choice(classes, products, p=_zipf_weights(classes, 0.8))
+    return pd.DataFrame({'PRODUCT_NAME': names,
+                         'PRODUCT_CLASS': np.char.add('Class ', cls.astype(str)).astype(object),
+                         'PRODUCT_CATEGORY': cls % 30 + 1})
+
+
+def synth_transactions(rows, month, names, customers, rng):
+    days = pd.Period(month).days_in_month
+    dates = np.datetime64(month + '-01') + rng.integers(0, days, rows)
+    ids = rng.integers(0, 10 ** 9, rows)
+    price = rng.integers(100, 10000, rows)
+    return pd.DataFrame({
+        'TX_ID': ['{:02d}-{:03d}-{:04d}'.format(i // 10 ** 7, i // 10 ** 4 % 1000, i % 10 ** 4)
+                  for i in ids.tolist()],
+        'TX_DATE': dates.astype(str).astype(object),
+        'CUSTOMER_ID': rng.integers(1000, 1000 + customers, rows),
+        # popular products sell more often
+        'PRODUCT_NAME': names[rng.choice(len(names), rows, p=_zipf_weights(len(names), 0.6))],
+        'PRICE': price,
+        'PURCH_COST': (price * rng.uniform(0.2, 0.9, rows)).astype(np.int64),
+        'QTY': rng.integers(1, 300, rows),
+    })
+
+
+def write_workbook(df, path):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(df.columns))
+    for row in zip(*[df[col].tolist() for col in df.columns]):
+        ws.append(row)
+    tmp_path = path + '.tmp'
+    wb.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# Writes workbooks shaped like data/: product_names_map.xlsx and
+# tx_data_YYYYMM.xlsx for each of `months` months of 2021, rows split evenly
+# (months past SHEET_ROWS span several tx_data_YYYYMM_N.xlsx). The same
+# arguments always give the same data, which is kept under bench/ and only
+# generated once. Returns the directory to run the pipeline in.
+def synth_dataset(rows, products=2500, classes=700, customers=1000, months=12, seed=0, root=None):
+    root = root or os.path.join(REPO_DIR, BENCH_DIR)
+    work = os.path.join(root, 'data_{}r_{}p_{}c_{}k_{}m_s{}'.format(
+        rows, products, classes, customers, months, seed))
+    data_dir = os.path.join(work, 'data')
+    done = os.path.join(work, 'complete')
+    if os.path.exists(done):
+        return work
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(data_dir)
+
+    mapper = synth_mapper(products, classes, np.random.default_rng([seed, 0]))
+    write_workbook(mapper, os.path.join(data_dir, 'product_names_map.xlsx'))
+    names = mapper['PRODUCT_NAME'].to_numpy()
+    for m, month_rows in enumerate(np.diff(np.linspace(0, rows, months + 1).astype(int))):
+        month = '2021-{:02d}'.format(m + 1)
+        parts = int(np.ceil(month_rows / SHEET_ROWS)) or 1
+        for p, part_rows in enumerate(np.diff(np.linspace(0, month_rows, parts + 1).astype(int))):
+            rng = np.random.default_rng([seed, m + 1, p])
+            df = synth_transactions(part_rows, month, names, customers, rng)
+            name = 'tx_data_2021{:02d}{}.xlsx'.format(m + 1, '_{}'.format(p + 1) if parts > 1 else '')
+            write_workbook(df, os.path.join(data_dir, name))
+    open(done, 'w').close()
+    return work
+
+
+# One pass of main.py's pipeline over the workbooks in work/data, every
+# stage timed on its own: ingest (mapper and workbooks, from the columnar
+# cache when warm), features, aggregate, then one data:<node> per data node
+# of the report spec the deck needs, one chart:<name> per chart, slides and
+# save. Partitions and nodes run in this process so that stage times add
+# up. Returns (Timings, rows).
+def run_pipeline(work, template_path=None, img_folder=None, native_charts=False, warm=False, spec=None):
+    template_path = template_path or os.path.join(REPO_DIR, 'design_template.pptx')
+    img_folder = img_folder or os.path.join(REPO_DIR, 'img')
+    spec = spec or load_spec()
+    slides = deck_slides(spec, native_charts)
+    needed, charts = slide_needs(slides, spec.get('charts', {}))
+    timings = Timings()
+    with _cwd(work):
+        cache_dir = os.path.join(work, 'data', CACHE_DIR)
+        if not warm:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        cache = ColumnarCache(cache_dir)
+
+        with timings('ingest'):
+            mapper = consolidate_data('map')
+            frames = [read_workbook(path, cache, compact=True)
+                      for path in data_files('tx_data_')]
+        rows = sum(len(df) for df in frames)
+        with timings('features'):
+            frames = [compact_frame(attach_mapper(generate_features(df), mapper, compact=True))
+                      for df in frames]
+        with timings('aggregate'):
+            agg = tree_reduce(Aggregates.merge, [Aggregates.from_frame(df) for df in frames])
+
+        graph = ReportGraph(spec, {'agg': agg})
+        graph.compute(needed, workers=1, stage=timings)
+        images = {}
+        for name in charts:
+            job = graph.chart_job(name, image=spec.get('image'))
+            with timings('chart:' + name):
+                images[name] = render_job(job)
+        with timings('slides'):
+            report = assemble_slides(slides, graph, images, os.path.join(work, 'report.pptx'),
+                                     template_path, spec['label'], img_folder)
+        with timings('save'):
+            report.save_file()
+    return timings, rows
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty)
+
+
+# Benchmarks the pipeline on a synthetic dataset: `repeat` runs (after an
+# untimed one that fills the cache when warm), keeping each stage's fastest
+# wall and CPU time. The result is appended to bench/results.jsonl with the
+# commit it ran on and returned.
+def benchmark(rows, products=2500, classes=700, customers=1000, months=12, seed=0,
+              repeat=3, warm=False, native_charts=False, results=None):
+    work = synth_dataset(rows, products, classes, customers, months, seed)
+    if warm:
+        run_pipeline(work, native_charts=native_charts, warm=False)
+    runs = [run_pipeline(work, native_charts=native_charts, warm=warm)[0]
+            for _ in range(repeat)]
+    stages = {name: {key: round(min(run.stages[name][key] for run in runs), 4)
+                     for key in ('wall', 'cpu')}
+              for name in runs[0].stages}
+    commit, dirty = git_commit()
+    record = {'commit': commit, 'dirty': dirty, 'time': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'machine': platform.machine(),
+              'cpus': os.cpu_count(), 'config': config_key(rows, products, classes, customers, months,
+                                                           seed, warm, native_charts),
+              'repeat': repeat, 'stages': stages,
+              'total': round(sum(stage['wall'] for stage in stages.values()), 4)}
+    results = results or os.path.join(REPO_DIR, BENCH_DIR, RESULTS_FILE)
+    os.makedirs(os.path.dirname(results), exist_ok=True)
+    with open(results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return record
+
+
+def config_key(rows, products, classes, customers, months, seed, warm, native_charts):
+    return {'rows': rows, 'products': products, 'classes': classes, 'customers': customers,
+            'months': months, 'seed': seed, 'cache': 'warm' if warm else 'cold',
+            'charts': 'native' if native_charts else 'raster'}
+
+
+def load_results(results=None):
+    results = results or os.path.join(REPO_DIR, BENCH_DIR, RESULTS_FILE)
+    if not os.path.exists(results):
+        return []
+    with open(results) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Stage-by-stage wall times of two commits' latest results for the same
+# config: base defaults to the commit benchmarked before head, head to the
+# latest. Returns a frame of base and head seconds and head / base.
+def compare(config, base=None, head=None, results=None):
+    runs = [r for r in load_results(results) if r['config'] == config]
+    if not runs:
+        raise ValueError('No benchmark results for {}'.format(config))
+    latest = {}
+    for run in runs:
+        latest.pop(run['commit'], None)
+        latest[run['commit']] = run
+    commits = list(latest)
+    head = head or commits[-1]
+    if base is None:
+        older = commits[:commits.index(head)] if head in commits else []
+        if not older:
+            raise ValueError('No earlier commit to compare {} with'.format(head))
+        base = older[-1]
+    for commit in (base, head):
+        if commit not in latest:
+            raise ValueError('No benchmark results for commit {}'.format(commit))
+    if base == head:
+        raise ValueError('Compare {} with another commit'.format(head))
+    stages = {commit: {k: v['wall'] for k, v in latest[commit]['stages'].items()}
+              for commit in (base, head)}
+    order = list(stages[head]) + [k for k in stages[base] if k not in stages[head]]
+    table = pd.DataFrame(stages).reindex(order)
+    table.loc['TOTAL'] = table.sum()
+    table['ratio'] = (table[head] / table[base]).round(2)
+    return table
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+CACHE_DIR = '.cache'
+_MANIFEST = 'manifest.json'
+_HASH_BLOCK = 1 << 20
+
+
+def content_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def predicate_mask(values, pred):
+    # pred is either a collection of allowed values or a callable on a Series
+    values = pd.Series(values)
+    if callable(pred):
+        return np.asarray(pred(values), dtype=bool)
+    return values.isin(list(pred)).to_numpy()
+
+
+def filter_rows(df, filters=None):
+    if not filters:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for col, pred in filters.items():
+        mask &= predicate_mask(df[col], pred)
+    return df[mask].reset_index(drop=True)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+# One directory of per-column .npy files per source workbook. Entries are
+# keyed by path and checked against size/mtime first; when those differ the
+# SHA-1 decides, so a merely touched workbook keeps its entry.
+class ColumnarCache():
+    def __init__(self, cache_dir, mmap=True):
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+
+    def _entry_dir(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:16])
+
+    def _read_manifest(self, entry):
+        try:
+            with open(os.path.join(entry, _MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, entry, manifest):
+        tmp_path = os.path.join(entry, _MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(entry, _MANIFEST))
+
+    def lookup(self, path):
+        entry = self._entry_dir(path)
+        manifest = self._read_manifest(entry)
+        if manifest is None:
+            return None
+        sig = file_signature(path)
+        if (manifest['size'], manifest['mtime_ns']) == (sig['size'], sig['mtime_ns']):
+            return manifest
+        if manifest['size'] == sig['size'] and manifest['sha1'] == content_hash(path):
+            manifest.update(sig)
+            self._write_manifest(entry, manifest)
+            return manifest
+        return None
+
+    def load(self, path, manifest=None, columns=None, categories=None, filters=None):
+        manifest = manifest or self.lookup(path)
+        if manifest is None:
+            return None
+        opened = self._open(path, manifest, columns, categories)
+        rows = self._select(path, manifest, filters)
+        if rows is None:
+            data = {name: decode(values)
+                    for name, (values, decode) in opened.items()}
+            return pd.DataFrame(data, index=pd.RangeIndex(manifest['rows']))
+        data = {name: decode(values[rows])
+                for name, (values, decode) in opened.items()}
+        return pd.DataFrame(data, index=pd.RangeIndex(len(rows)))
+
+    def _select(self, path, manifest, filters):
+        # row predicates are evaluated on the stored columns (on the
+        # dictionary for string columns), so only matching rows get decoded
+        if not filters:
+            return None
+        entry = self._entry_dir(path)
+        mask = np.ones(manifest['rows'], dtype=bool)
+        by_name = {col['name']: col for col in manifest['columns']}
+        for name, pred in filters.items():
+            col = by_name[name]
+            if col['kind'] == 'dict':
+                codes = np.load(os.path.join(entry, col['codes']), mmap_mode='r')
+                uniques = np.load(os.path.join(entry, col['uniques']),
+                                  allow_pickle=not col['str_uniques'])
+                lut = np.append(predicate_mask(uniques.astype(object), pred), False)
+                mask &= lut[codes]
+            else:
+                values, decode = _open_column(entry, col, 'r')
+                mask &= predicate_mask(decode(values), pred)
+        return np.flatnonzero(mask)
+
+    def iter_chunks(self, path, budget, columns=None, categories=None):
+        manifest = self.lookup(path)
+        if manifest is None:
+            return None
+        return self._iter_chunks(self._open(path, manifest, columns, categories),
+                                 manifest['rows'], budget)
+
+    def _iter_chunks(self, opened, rows, budget):
+        start = 0
+        while start < rows:
+            stop = min(start + budget.rows, rows)
+            yield pd.DataFrame({name: decode(values[start:stop]) for name, (values, decode)
+                                in opened.items()}, index=pd.RangeIndex(start, stop))
+            start = stop
+
+    def _open(self, path, manifest, columns=None, categories=None):
+        entry = self._entry_dir(path)
+        mmap_mode = 'r' if self.mmap else None
+        return {col['name']: _open_column(entry, col, mmap_mode,
+                                          categories is not None and col['name'] in categories)
+                for col in manifest['columns']
+                if columns is None or col['name'] in columns}
+
+    def store(self, path, df, sha1=None):
+        entry = self._entry_dir(path)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.makedirs(entry)
+        columns = [_encode_column(entry, i, name, df[name])
+                   for i, name in enumerate(df.columns)]
+        manifest = file_signature(path)
+        manifest.update({'sha1': sha1 or content_hash(path), 'rows': len(df),
+                         'columns': columns})
+        self._write_manifest(entry, manifest)
+        return manifest
+
+    def read_excel(self, path, categories=None, filters=None, **kwargs):
+        df = self.load(path, categories=categories, filters=filters)
+        if df is not None:
+            return df
+        sha1 = content_hash(path)
+        df = pd.read_excel(path, engine='openpyxl', **kwargs)
+        self.store(path, df, sha1)
+        return filter_rows(df, filters)
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+
+def _encode_column(entry, i, name, series):
+    col = {'name': name, 'dtype': str(series.dtype)}
+    values = series.values
+    if series.dtype == object or pd.api.types.is_categorical_dtype(series.dtype):
+        codes, uniques = pd.factorize(series)
+        uniques = np.asarray(uniques, dtype=object)
+        col['kind'] = 'dict'
+        col['codes'] = '{}.codes.npy'.format(i)
+        col['uniques'] = '{}.uniques.npy'.format(i)
+        col['str_uniques'] = all(isinstance(u, str) for u in uniques)
+        if col['str_uniques']:
+            uniques = uniques.astype(str)
+        np.save(os.path.join(entry, col['codes']), codes.astype(np.int32))
+        np.save(os.path.join(entry, col['uniques']), uniques,
+                allow_pickle=not col['str_uniques'])
+    elif pd.api.types.is_datetime64_dtype(series.dtype):
+        col['kind'] = 'datetime'
+        col['file'] = '{}.npy'.format(i)
+        np.save(os.path.join(entry, col['file']), values.view('i8'))
+    else:
+        col['kind'] = 'plain'
+        col['file'] = '{}.npy'.format(i)
+        np.save(os.path.join(entry, col['file']), values)
+    return col
+
+
+def _open_column(entry, col, mmap_mode, categorical=False):
+    # returns the stored array and a decoder that can be applied to any slice
+    if col['kind'] == 'dict':
+        codes = np.load(os.path.join(entry, col['codes']), mmap_mode=mmap_mode)
+        uniques = np.load(os.path.join(entry, col['uniques']),
+                          allow_pickle=not col['str_uniques'])
+        if not categorical:
+            uniques = uniques.astype(object)
+            return codes, lambda c: np.asarray(pd.Categorical.from_codes(c, uniques))
+        # sorted categories keep grouping order identical to plain strings
+        order = np.argsort(uniques, kind='stable')
+        rank = np.empty(len(order) + 1, dtype=np.int32)
+        rank[order] = np.arange(len(order))
+        rank[-1] = -1
+        cats = uniques[order].astype(object)
+        return codes, lambda c: pd.Categorical.from_codes(rank[c], cats)
+    values = np.load(os.path.join(entry, col['file']), mmap_mode=mmap_mode)
+    if col['kind'] == 'datetime':
+        return values, lambda v: np.asarray(v).view(col['dtype'])
+    return values, lambda v: v
@@ -1,10 +1,80 @@
-import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import six
+import colorsys
+import io
+from collections import OrderedDict
 import numpy as np
+import pandas as pd
+from ReportGen.downsample import lttb
+from ReportGen.images import IMAGE_PPI, chart_dpi, encode
+from ReportGen.instrument import instrumented
+from ReportGen.prep import is_box_summary
 
-sns.set_style(style='white')
+
+_backends = {}
+
+
+def _plotting():
+    # seaborn and matplotlib load with the first chart drawn, not on import
+    if not _backends:
+        import seaborn as sns
+        import matplotlib.pyplot as plt
+        sns.set_style(style='white')
+        _backends.update(sns=sns, plt=plt)
+    return _backends['sns'], _backends['plt']
+
+
+# Figures drawn outside pyplot, so no global current figure or registry
+# keeps them alive. A released figure is cleared and handed out again to the
+# next chart of the same size. Tables size their figures from the data, so
+# sizes are unbounded: at most max_idle figures are kept in all, and the size
+# least recently released or reused gives up its figures first.
+class FigurePool():
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = OrderedDict()
+        self.count = 0
+
+    @staticmethod
+    def _key(figsize):
+        return tuple(round(float(v), 4) for v in figsize)
+
+    def acquire(self, figsize):
+        key = self._key(figsize)
+        figs = self.idle.get(key)
+        if figs:
+            self.count -= 1
+            fig = figs.pop()
+            if figs:
+                self.idle.move_to_end(key)
+            else:
+                del self.idle[key]
+            return fig
+        _plotting()
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        return fig
+
+    def release(self, fig):
+        from matplotlib import rcParams
+        fig.clear()
+        # e.g. autofmt_xdate moves the subplot edges
+        fig.subplots_adjust(**{k: rcParams['figure.subplot.' + k] for k in
+                               ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')})
+        key = self._key(fig.get_size_inches())
+        self.idle.setdefault(key, []).append(fig)
+        self.idle.move_to_end(key)
+        self.count += 1
+        while self.count > self.max_idle:
+            oldest = next(iter(self.idle))
+            figs = self.idle[oldest]
+            figs.pop(0)
+            self.count -= 1
+            if not figs:
+                del self.idle[oldest]
+
+
+_figures = FigurePool()
 
 
 class Chart():
@@ -19,29 +89,64 @@ class Chart():
             self.path = None
         self.row_dim = row_dim
         self.col_dim = col_dim
+        self.buffer = None
+        self.fig = None
 
-    @staticmethod
-    def _plot_setup(row_dim, col_dim, x_lab, y_lab, b_rt_spine, b_lt_spine, b_tp_spine):
-        fig, ax = plt.subplots(figsize=(row_dim, col_dim))
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # hands the figure back to the pool; the saved buffer stays valid
+        if self.fig is not None:
+            _figures.release(self.fig)
+            self.fig = None
+
+    def _plot_setup(self, row_dim, col_dim, x_lab, y_lab, b_rt_spine, b_lt_spine, b_tp_spine):
+        self.close()
+        fig = self.fig = _figures.acquire((row_dim, col_dim))
+        ax = fig.add_subplot()
         ax.spines['left'].set_visible(b_lt_spine)
         ax.spines['right'].set_visible(b_rt_spine)
         ax.spines['top'].set_visible(b_tp_spine)
         ax.set(xlabel=x_lab, ylabel=y_lab)
         return fig, ax
 
-    def _save(self, **kwargs):
+    @staticmethod
+    def _encode(fig, **kwargs):
+        # width: inches the image is shown at on the slide (the figure's own
+        # width by default), rendered at ppi pixels per inch; fmt, colors and
+        # quality as for images.encode
         bbox_inches = kwargs.get('bbox_inches', 'tight')
         pad_inches = kwargs.get('pad_inches', 0.1)
+        width = kwargs.get('width', None)
+        ppi = kwargs.get('ppi', IMAGE_PPI)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, bbox_inches=bbox_inches, pad_inches=pad_inches,
+                    format='png', dpi=chart_dpi(fig, width, ppi))
+        return encode(buffer, kwargs.get('fmt', 'png'), kwargs.get('colors', None),
+                      kwargs.get('quality', 85), ppi if width is not None else None)
+
+    def _save(self, **kwargs):
+        self.buffer = self._encode(self.fig, **kwargs)
+        self._write_paths(self.buffer)
+        self.buffer.seek(0)
+        return self.buffer
+
+    def _write_paths(self, buffer):
+        # the image is encoded once; every path gets a copy of the same bytes
         if self.paths_count > 1:
-            for i in range(self.paths_count):
-                file_path = getattr(self, 'path_{}'.format(i))
-                plt.savefig(file_path, bbox_inches=bbox_inches,
-                            pad_inches=pad_inches)
+            paths = [getattr(self, 'path_{}'.format(i))
+                     for i in range(self.paths_count)]
         elif self.paths_count == 1:
-            plt.savefig(self.path, bbox_inches=bbox_inches,
-                        pad_inches=pad_inches)
+            paths = [self.path]
         else:
-            pass
+            paths = []
+        for file_path in paths:
+            with open(file_path, 'wb') as f:
+                f.write(buffer.getvalue())
 
 
 class Box(Chart):
@@ -50,6 +155,7 @@ class Box(Chart):
         self.data = data
         self.combo_chart = kwargs.get('combo', False)
 
+    @instrumented
     def plot(self, x, y, **kwargs):
         x_lab = kwargs.get('x_lab', '')
         y_lab = kwargs.get('y_lab', '')
@@ -61,14 +167,58 @@ class Box(Chart):
         orient = kwargs.get('orient', 'h')
         color = kwargs.get('color', 'None')
 
+        sns, plt = _plotting()
         fig, ax = self._plot_setup(
             self.row_dim, self.col_dim, x_lab, y_lab, b_rt_spine, b_lt_spine, b_tp_spine)
-        ch = sns.boxplot(y=y, x=x, data=self.data, color=color,
-                         palette=palette, orient=orient, linewidth=linewidth, ax=ax)
+        if is_box_summary(self.data):
+            self._plot_summary(ax, palette, orient, linewidth)
+        else:
+            ch = sns.boxplot(y=y, x=x, data=self.data, color=color,
+                             palette=palette, orient=orient, linewidth=linewidth, ax=ax)
         ax.set(xlabel=x_lab, ylabel=y_lab)
 
+    def _plot_summary(self, ax, palette, orient, linewidth, fliersize=5, saturation=.75):
+        # draws prep.box_summary output (one row per box) the way
+        # sns.boxplot would draw the raw rows behind it
+        sns, plt = _plotting()
+        from matplotlib.colors import rgb2hex
+
+        summary = self.data
+        stats = [{'label': str(label), 'q1': row['q1'], 'med': row['med'], 'q3': row['q3'],
+                  'whislo': row['whislo'], 'whishi': row['whishi'],
+                  'fliers': list(row['fliers']) if 'fliers' in summary else []}
+                 for label, row in summary.iterrows()]
+        colors = [sns.desaturate(c, saturation)
+                  for c in sns.color_palette(palette, len(stats))]
+        lum = min(colorsys.rgb_to_hls(*c)[1] for c in colors) * .6
+        gray = rgb2hex((lum, lum, lum))
+
+        vert = orient == 'v'
+        artists = ax.bxp(stats, positions=np.arange(len(stats)), widths=.8, vert=vert,
+                         patch_artist=True, manage_ticks=False,
+                         boxprops={'edgecolor': gray, 'linewidth': linewidth},
+                         whiskerprops={'color': gray, 'linewidth': linewidth},
+                         capprops={'color': gray, 'linewidth': linewidth},
+                         medianprops={'color': gray, 'linewidth': linewidth},
+                         flierprops={'marker': 'd', 'markerfacecolor': gray, 'markeredgecolor': gray,
+                                     'markersize': fliersize, 'linestyle': 'none'})
+        for box, color in zip(artists['boxes'], colors):
+            box.set_facecolor(color)
+
+        labels = [st['label'] for st in stats]
+        if vert:
+            ax.set_xticks(np.arange(len(stats)))
+            ax.set_xticklabels(labels)
+            ax.set_xlim(-.5, len(stats) - .5)
+        else:
+            ax.set_yticks(np.arange(len(stats)))
+            ax.set_yticklabels(labels)
+            ax.set_ylim(-.5, len(stats) - .5)
+            ax.invert_yaxis()
+
+    @instrumented
     def save(self, **kwargs):
-        super()._save(**kwargs)
+        return super()._save(**kwargs)
 
 
 class Line(Chart):
@@ -79,6 +229,19 @@ class Line(Chart):
         self.combo_chart = kwargs.get('combo', False)
         self.main_data = data
 
+    @staticmethod
+    def _line(ax, x, y, data, max_points, **kwargs):
+        # the line sns.lineplot estimates (mean y per x, in x order) without
+        # bootstrapping a confidence band, thinned by LTTB to max_points
+        line = pd.DataFrame({'x': np.asarray(data[x] if isinstance(x, str) else x),
+                             'y': data[y].to_numpy()}).dropna()
+        if not (line['x'].is_monotonic_increasing and line['x'].is_unique):
+            line = line.groupby('x', sort=True)['y'].mean().reset_index()
+        kept = lttb(line['x'], line['y'], max_points)
+        ax.plot(line['x'].to_numpy()[kept], line['y'].to_numpy()[kept], **kwargs)
+        return ax
+
+    @instrumented
     def plot(self, x, y, multi_line_fmt=1, **kwargs):
         x_lab = kwargs.get('x_lab', '')
         y_lab = kwargs.get('y_lab', '')
@@ -92,23 +255,37 @@ class Line(Chart):
         color = kwargs.get('color', 'red')
         selector_col = kwargs.get('selector_col', None)
         x_axis_time = kwargs.get('x_axis_time', False)
+        # fast: pre-aggregated lines, at most one point per pixel of width
+        fast = kwargs.get('fast', True)
 
-        if not self.combo_chart:
+        sns, plt = _plotting()
+        if (not self.combo_chart) | (combo_ax is None):
             fig, ax = self._plot_setup(
                 self.row_dim, self.col_dim, x_lab, y_lab, b_rt_spine, b_lt_spine, b_tp_spine)
+            max_points = kwargs.get(
+                'max_points', int(fig.get_figwidth() * fig.dpi))
 
         if self.multi_line:
             if multi_line_fmt == 1:
                 selector_alpha_map = dict(
                     zip(self.idx_data, np.arange(0.3, 1, step=1/len(self.idx_data))))
-                for selector, a in selector_alpha_map.items():
-                    filt_data = self.main_data[self.main_data[selector_col] == selector]
-                    ch = sns.lineplot(x=x, y=y, data=filt_data,
-                                      palette=palette, alpha=a, ax=ax)
+                if fast:
+                    # one pass over the frame splits every selector's rows
+                    groups = {key: group for key, group in self.main_data.groupby(
+                        selector_col, sort=False, observed=True)}
+                    for selector, a in selector_alpha_map.items():
+                        if selector in groups:
+                            ch = self._line(ax, x, y, groups[selector], max_points, alpha=a)
+                else:
+                    for selector, a in selector_alpha_map.items():
+                        filt_data = self.main_data[self.main_data[selector_col] == selector]
+                        ch = sns.lineplot(x=x, y=y, data=filt_data,
+                                          palette=palette, alpha=a, ax=ax)
                 ch.legend(labels=selector_alpha_map.keys())
             elif multi_line_fmt == 2:
+                from matplotlib.colors import TABLEAU_COLORS
                 colors = kwargs.get(
-                    'm_colors', list(mcolors.TABLEAU_COLORS.values()))
+                    'm_colors', list(TABLEAU_COLORS.values()))
                 y_lab_list = kwargs.get('y_list', None)
                 leg_lab_list = kwargs.get('leg_lab_list', None)
                 colors = colors[:len(y_lab_list)]
@@ -124,31 +301,40 @@ class Line(Chart):
                     return
 
                 for var, color, label in zip(y_lab_list, colors, leg_lab_list):
-                    ch = sns.lineplot(x=x, y=var, data=self.main_data,
-                                      color=color, label=label, ax=ax)
+                    if fast:
+                        ch = self._line(ax, x, var, self.main_data, max_points,
+                                        color=color, label=label)
+                    else:
+                        ch = sns.lineplot(x=x, y=var, data=self.main_data,
+                                          color=color, label=label, ax=ax)
                 ax.legend()
         else:
             if (self.combo_chart) & (combo_ax != None):
                 ch = sns.lineplot(x=x, y=y, data=self.main_data, color=color,
                                   palette=palette, alpha=alpha, ax=combo_ax)
+                combo_ax.set(ylabel=y_lab)
+                combo_ax.spines['top'].set_visible(b_tp_spine)
+            elif fast:
+                ch = self._line(ax, x, y, self.main_data, max_points,
+                                color=color, alpha=alpha)
             else:
                 ch = sns.lineplot(x=x, y=y, data=self.main_data, color=color,
                                   palette=palette, alpha=alpha, ax=ax)
 
         if x_axis_time:
-            plt.gcf().autofmt_xdate()
+            ch.get_figure().autofmt_xdate()
 
         if (not self.combo_chart) | (combo_ax != None):
-            self.save()
             return ch
         elif self.combo_chart:
-            combo_ax = plt.twinx()
+            combo_ax = ax.twinx()
             # combo_ax.set(ylabel=y_lab)
             # combo_ax.spines['top'].set_visible(False)
             return ch, combo_ax
 
+    @instrumented
     def save(self, **kwargs):
-        super()._save(**kwargs)
+        return super()._save(**kwargs)
 
 
 class Bar(Chart):
@@ -157,6 +343,7 @@ class Bar(Chart):
         self.data = data
         self.combo_chart = kwargs.get('combo', False)
 
+    @instrumented
     def plot(self, x, y, **kwargs):
         x_lab = kwargs.get('x_lab', '')
         y_lab = kwargs.get('y_lab', '')
@@ -168,6 +355,7 @@ class Bar(Chart):
         orient = kwargs.get('orient', 'h')
         color = kwargs.get('color', 'None')
 
+        sns, plt = _plotting()
         fig, ax = self._plot_setup(
             self.row_dim, self.col_dim, x_lab, y_lab, b_rt_spine, b_lt_spine, b_tp_spine)
 
@@ -176,34 +364,58 @@ class Bar(Chart):
         ax.set(xlabel=x_lab, ylabel=y_lab)
 
         if not self.combo_chart:
-            self.save()
             return ch
         else:
-            combo_ax = plt.twinx()
+            combo_ax = ax.twinx()
             return ch, combo_ax
 
+    @instrumented
     def save(self, **kwargs):
-        super()._save(**kwargs)
+        return super()._save(**kwargs)
 
 
 class Table():
-    def __init__(self, row_height, col_width, data, path, **kwargs):
+    def __init__(self, row_height, col_width, data, path=None, **kwargs):
         self.row_dim = row_height
         self.col_dim = col_width
         self.data = data
         self.path = path
+        self.ax = None
+        self.buffer = None
+        self.fig = None
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.fig is not None:
+            _figures.release(self.fig)
+            self.fig = None
+            self.ax = None
+
+    @instrumented
     def plot(self, **kwargs):
         font_size = kwargs.get('font_size', 12)
-        ch = self._render_mpl_table(
+        self.ax = self._render_mpl_table(
             self.data, col_width=self.col_dim, font_size=font_size, row_height=self.row_dim, **kwargs)
-        self._save(ch, self.path)
+        return self.ax
+
+    @instrumented
+    def save(self, **kwargs):
+        self.buffer = self._save(self.ax, self.path, **kwargs)
+        return self.buffer
 
     def _render_mpl_table(self, data, col_width=3.0, row_height=0.625, font_size=14, header_color='#40466e', row_colors=['#f1f1f2', 'w'], edge_color='w', bbox=[0, 0, 1, 1], header_columns=0, ax=None, **kwargs):
+        sns, plt = _plotting()
         if ax is None:
             size = (np.array(data.shape[::-1]) + np.array([0, 1])
                     ) * np.array([col_width, row_height])
-            fig, ax = plt.subplots(figsize=size)
+            self.close()
+            self.fig = _figures.acquire(size)
+            ax = self.fig.add_subplot()
             ax.axis('off')
 
         mpl_table = ax.table(cellText=data.values, bbox=bbox,
@@ -212,7 +424,7 @@ class Table():
         mpl_table.auto_set_font_size(False)
         mpl_table.set_fontsize(font_size)
 
-        for k, cell in six.iteritems(mpl_table._cells):
+        for k, cell in mpl_table._cells.items():
             cell.set_edgecolor(edge_color)
             if k[0] == 0 or k[1] < header_columns:
                 cell.set_text_props(weight='bold', color='w')
@@ -223,7 +435,9 @@ class Table():
 
     @staticmethod
     def _save(ax, path, **kwargs):
-        bbox_inches = kwargs.get('bbox_inches', 'tight')
-        pad_inches = kwargs.get('pad_inches', 0.1)
-        ax.get_figure().savefig(path, bbox_inches=bbox_inches,
-                                pad_inches=pad_inches)
+        buffer = Chart._encode(ax.get_figure(), **kwargs)
+        if path is not None:
+            with open(path, 'wb') as f:
+                f.write(buffer.getvalue())
+        buffer.seek(0)
+        return buffer
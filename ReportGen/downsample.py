@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        values = values.astype('datetime64[ns]').view('int64')
+    return values.astype(float)
+
+
+# Positions of n of the points (x, y), x sorted, picked by Largest-Triangle-
+# Three-Buckets: the first and last points, then from each of n - 2 equal
+# buckets the point spanning the largest triangle with the one kept before it
+# and the mean of the next bucket. Peaks and troughs survive, so a line
+# through the kept points looks like the full one at n pixels wide. x may be
+# numeric or datetime.
+def lttb(x, y, n):
+    size = len(y)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        raise ValueError('lttb keeps at least 3 points, got n={}'.format(n))
+    x = _as_float(x)
+    y = _as_float(y)
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    kept = np.empty(n, dtype=np.int64)
+    kept[0], kept[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(hi, edges[i + 2]) if i + 2 < n - 1 else slice(size - 1, size)
+        cx, cy = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
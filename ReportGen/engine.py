@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+
+AGGFUNCS = ('sum', 'mean', 'count')
+_EXACT_FLOAT = 2 ** 53
+
+
+def _key_name(key):
+    return tuple(key) if isinstance(key, (list, tuple)) else key
+
+
+def _as_index(uniques, name):
+    if pd.api.types.is_categorical_dtype(uniques):
+        uniques = np.asarray(uniques)
+    return pd.Index(uniques, name=name)
+
+
+def _factorize(series):
+    if pd.api.types.is_categorical_dtype(series):
+        cats = series.cat.categories
+        if not cats.is_monotonic_increasing:
+            series = series.cat.reorder_categories(cats.sort_values())
+    return pd.factorize(series, sort=True)
+
+
+def factorize_key(df, key):
+    if not isinstance(key, (list, tuple)):
+        codes, uniques = _factorize(df[key])
+        return codes, _as_index(uniques, key)
+
+    parts = [_factorize(df[k]) for k in key]
+    sizes = [max(len(uniques), 1) for _, uniques in parts]
+    missing = np.zeros(len(df), dtype=bool)
+    for codes, _ in parts:
+        missing |= codes < 0
+    flat = np.ravel_multi_index(
+        [np.where(missing, 0, codes) for codes, _ in parts], sizes)
+    # rows with a missing key part belong to no group
+    codes = np.full(len(df), -1, dtype=np.intp)
+    codes[~missing], groups = pd.factorize(flat[~missing], sort=True)
+    groups = np.asarray(groups)
+    levels = np.unravel_index(groups, sizes)
+    index = pd.MultiIndex.from_arrays(
+        [_as_index(uniques, k).take(level)
+         for (_, uniques), k, level in zip(parts, key, levels)], names=list(key))
+    return codes, index
+
+
+def _count(codes, values, ngroups):
+    # non-null values per group, of any dtype
+    valid = (codes >= 0) & pd.notna(values)
+    return np.bincount(codes[valid], minlength=ngroups)
+
+
+def _sum_count(codes, values, ngroups):
+    valid = codes >= 0
+    if values.dtype.kind == 'f':
+        valid &= ~np.isnan(values)
+    elif values.dtype.kind not in 'iub':
+        values = pd.to_numeric(pd.Series(values)).to_numpy(dtype=float)
+        valid &= ~np.isnan(values)
+    grp = codes[valid]
+    vals = values[valid]
+    counts = np.bincount(grp, minlength=ngroups)
+    if vals.dtype.kind == 'f':
+        return np.bincount(grp, weights=vals, minlength=ngroups), counts
+    if len(vals) == 0 or int(np.abs(vals).max()) * len(vals) < _EXACT_FLOAT:
+        sums = np.bincount(grp, weights=vals, minlength=ngroups)
+        return sums.round().astype(np.int64), counts
+    # integer totals beyond float precision: exact segment sums on sorted codes
+    order = np.argsort(grp, kind='stable')
+    sums = np.zeros(ngroups, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, np.diff(grp[order]) != 0])
+    sums[grp[order][starts]] = np.add.reduceat(
+        vals[order].astype(np.int64), starts)
+    return sums, counts
+
+
+# Runs a batch of (key, columns, aggfuncs) requests over df without copying
+# it. Each key is factorized once and every column is reduced with a single
+# bincount, so sum/mean/count for the same key share one pass. Results are
+# keyed by (key, aggfunc); keys given as lists come back as tuples.
+def aggregate(df, requests):
+    keys = {}
+    reduced = {}
+    wanted = {}
+    for key, cols, aggfuncs in requests:
+        name = _key_name(key)
+        aggfuncs = [aggfuncs] if isinstance(aggfuncs, str) else list(aggfuncs)
+        for func in aggfuncs:
+            if func not in AGGFUNCS:
+                raise ValueError(
+                    'Unsupported aggfunc {!r}; expected one of {}'.format(func, AGGFUNCS))
+            out_cols = wanted.setdefault((name, func), [])
+            out_cols.extend(c for c in cols if c not in out_cols)
+        if name not in keys:
+            keys[name] = factorize_key(df, key)
+
+    # columns only counted are never converted to numbers
+    summed = {(name, col) for (name, func), cols in wanted.items()
+              if func != 'count' for col in cols}
+    for (name, func), cols in wanted.items():
+        codes, index = keys[name]
+        for col in cols:
+            if (name, col) in reduced:
+                continue
+            if (name, col) in summed:
+                reduced[(name, col)] = _sum_count(
+                    codes, df[col].to_numpy(), len(index))
+            else:
+                reduced[(name, col)] = None, _count(
+                    codes, df[col].to_numpy(), len(index))
+
+    results = {}
+    for (name, func), cols in wanted.items():
+        index = keys[name][1]
+        data = {}
+        for col in cols:
+            sums, counts = reduced[(name, col)]
+            if func == 'sum':
+                data[col] = sums
+            elif func == 'count':
+                data[col] = counts
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    data[col] = sums / counts
+        results[(name, func)] = pd.DataFrame(data, index=index, columns=cols)
+    return results
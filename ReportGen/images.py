@@ -0,0 +1,81 @@
+import io
+import os
+
+
+# Pixels per inch of slide a chart image is rendered at. At 100, the
+# matplotlib default, a chart shown at its figure size keeps its pixels.
+IMAGE_PPI = 100
+
+
+def chart_dpi(fig, width=None, ppi=IMAGE_PPI):
+    # dpi to save fig at so that, shown width inches wide (its own width by
+    # default), it has ppi pixels per inch
+    return ppi if width is None else ppi * width / fig.get_figwidth()
+
+
+# Re-encodes a PNG buffer: quantized to a palette of `colors` (charts are
+# mostly flat fills, so 256 or fewer rarely show) or as a JPEG of the given
+# quality, with ppi as its resolution tag, which python-pptx turns into the
+# picture's size on the slide. Returns the buffer untouched when there is
+# nothing to do.
+def encode(buffer, fmt='png', colors=None, quality=85, ppi=None):
+    fmt = fmt.lower()
+    if fmt == 'png' and colors is None and ppi is None:
+        return buffer
+    from PIL import Image
+    buffer.seek(0)
+    img = Image.open(buffer)
+    dpi = (ppi, ppi) if ppi is not None else img.info.get('dpi', (IMAGE_PPI, IMAGE_PPI))
+    out = io.BytesIO()
+    if fmt in ('jpeg', 'jpg'):
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            flat = Image.new('RGB', img.size, 'white')
+            flat.paste(img, mask=img.getchannel('A'))
+            img = flat
+        img.convert('RGB').save(out, 'JPEG', quality=quality, optimize=True,
+                                progressive=True, dpi=dpi)
+    elif fmt == 'png':
+        if colors is not None:
+            if img.mode == 'RGBA' and img.getchannel('A').getextrema()[0] == 255:
+                img = img.convert('RGB')
+            # median cut (0) keeps near-white fills such as table row stripes
+            # apart; PIL quantizes RGBA only by fast octree (2)
+            img = img.quantize(colors, method=0 if img.mode == 'RGB' else 2, dither=0)
+        img.save(out, 'PNG', optimize=True, dpi=dpi)
+    else:
+        raise ValueError('Unsupported image format {!r}'.format(fmt))
+    out.seek(0)
+    return out
+
+
+_images = {}
+
+
+# Image files (logos and the like) read once per process and handed out as
+# in-memory buffers, so every deck built here embeds the same bytes.
+def load_image(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _images:
+        with open(path, 'rb') as f:
+            _images[key] = f.read()
+    return io.BytesIO(_images[key])
+
+
+# Size of every picture in a presentation, in slide order. Pictures with the
+# same bytes are stored once in the .pptx (python-pptx shares the image part),
+# so only the first of them is counted in the deck's image bytes.
+def image_sizes(prs):
+    seen = set()
+    sizes = []
+    for i, slide in enumerate(prs.slides, 1):
+        for shape in slide.shapes:
+            image = getattr(shape, 'image', None)
+            if image is None:
+                continue
+            sizes.append({'slide': i, 'name': shape.name, 'format': image.ext,
+                          'pixels': list(image.size), 'bytes': len(image.blob),
+                          'shared': image.sha1 in seen})
+            seen.add(image.sha1)
+    return sizes
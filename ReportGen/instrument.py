@@ -0,0 +1,232 @@
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# REPORTGEN_INSTRUMENT=1 records every instrumented stage of a run (memory
+# adds tracemalloc peaks, at a cost); REPORTGEN_PROFILE=<stage> also
+# cProfiles that stage, e.g. prep.generate_features or charts.Line.plot.
+INSTRUMENT_ENV = 'REPORTGEN_INSTRUMENT'
+PROFILE_ENV = 'REPORTGEN_PROFILE'
+RUN_SUFFIX = '.run.json'
+
+_active = None
+
+
+def options_from_env(env=None):
+    # Recorder options, or None when instrumentation is off
+    env = os.environ if env is None else env
+    mode = env.get(INSTRUMENT_ENV, '').strip().lower()
+    profile = env.get(PROFILE_ENV) or None
+    if mode in ('', '0', 'off', 'false') and profile is None:
+        return None
+    return {'trace_memory': mode == 'memory', 'profile': profile}
+
+
+def add_arguments(parser):
+    parser.add_argument('--instrument', action='store_true',
+                        help='write a run manifest of per-stage timings next to the output '
+                             '(also {}=1)'.format(INSTRUMENT_ENV))
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='add tracemalloc peaks to the manifest ({}=memory)'.format(INSTRUMENT_ENV))
+    parser.add_argument('--profile', metavar='STAGE',
+                        help='cProfile one stage, e.g. prep.generate_features ({})'.format(PROFILE_ENV))
+
+
+def options_from_args(args, env=None):
+    # the command line switches on top of the environment's
+    options = options_from_env(env)
+    if args.instrument or args.trace_memory or args.profile:
+        options = options or {'trace_memory': False, 'profile': None}
+        options['trace_memory'] = options['trace_memory'] or args.trace_memory
+        options['profile'] = args.profile or options['profile']
+    return options
+
+
+def _rows(obj):
+    # rows of a frame or series, summed over a tuple or list of them
+    if hasattr(obj, 'index') and hasattr(obj, 'shape'):
+        return len(obj)
+    if isinstance(obj, (list, tuple)):
+        counts = [n for n in map(_rows, obj) if n is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+def _rss_peak_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+class _Stats():
+    # cProfile stats shipped back from a worker, in the shape pstats loads
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+# Wall and CPU seconds, peak RSS (and the tracemalloc peak with
+# trace_memory) and rows in and out of every stage run while this recorder
+# is active, in the order the stages started; depth is the nesting level
+# within the thread that ran the stage, named for threads other than the
+# main one (tracemalloc peaks overlap across threads). The stage named by
+# profile runs under cProfile, every call of it adding to the same profile.
+class Recorder():
+    def __init__(self, trace_memory=False, profile=None):
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.stages = []
+        self.profiles = []
+        self.started = datetime.now()
+        self._clock = (time.perf_counter(), time.process_time())
+        self._local = threading.local()
+        self._profiler = None
+
+    @property
+    def _stack(self):
+        # stages open in the calling thread
+        return self._local.__dict__.setdefault('stack', [])
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        entry = {'stage': name, 'depth': len(self._stack), 'rows_in': rows_in, 'rows_out': None}
+        if threading.current_thread() is not threading.main_thread():
+            entry['thread'] = threading.current_thread().name
+        self.stages.append(entry)
+        if self.trace_memory:
+            if self._stack:
+                parent = self._stack[-1]
+                parent['_peak'] = max(parent['_peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            entry['_start'] = entry['_peak'] = tracemalloc.get_traced_memory()[0]
+        self._stack.append(entry)
+        profiler = None
+        if name == self.profile and self._profiler is None:
+            profiler = self._profiler = cProfile.Profile()
+            profiler.enable()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            entry['wall'] = round(time.perf_counter() - wall, 6)
+            entry['cpu'] = round(time.process_time() - cpu, 6)
+            if profiler is not None:
+                profiler.disable()
+                profiler.create_stats()
+                self.profiles.append(_Stats(profiler.stats))
+                self._profiler = None
+            self._stack.pop()
+            entry['rss_peak_mb'] = _rss_peak_mb()
+            if self.trace_memory:
+                peak = max(entry.pop('_peak'), tracemalloc.get_traced_memory()[1])
+                entry['traced_peak_mb'] = round((peak - entry.pop('_start')) / 2 ** 20, 3)
+                if self._stack:
+                    self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+                tracemalloc.reset_peak()
+
+    def export(self):
+        return {'stages': self.stages, 'profiles': [p.stats for p in self.profiles],
+                'pid': os.getpid()}
+
+    def absorb(self, exported):
+        # stages recorded in a worker process, nested under the current stage
+        depth = len(self._stack)
+        for entry in exported['stages']:
+            self.stages.append(dict(entry, depth=entry['depth'] + depth, pid=exported['pid']))
+        self.profiles += [_Stats(stats) for stats in exported['profiles']]
+
+    def summary(self):
+        return {'started': self.started.isoformat(timespec='seconds'),
+                'wall': round(time.perf_counter() - self._clock[0], 6),
+                'cpu': round(time.process_time() - self._clock[1], 6),
+                'rss_peak_mb': _rss_peak_mb(), 'trace_memory': self.trace_memory}
+
+
+def active():
+    return _active
+
+
+@contextmanager
+def recording(recorder):
+    # makes recorder the one instrumented calls report to
+    global _active
+    previous, _active = _active, recorder
+    started = recorder.trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield recorder
+    finally:
+        _active = previous
+        if started:
+            tracemalloc.stop()
+
+
+def stage(name, rows_in=None):
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name, rows_in)
+
+
+def instrumented(func=None, name=None):
+    # records each call as a stage named module.qualname (e.g.
+    # prep.generate_features); a single global check when nothing records
+    if func is None:
+        return functools.partial(instrumented, name=name)
+    name = name or '{}.{}'.format(func.__module__.rsplit('.', 1)[-1], func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _active is None:
+            return func(*args, **kwargs)
+        with _active.stage(name, _rows(args)) as entry:
+            out = func(*args, **kwargs)
+            entry['rows_out'] = _rows(out)
+            return out
+    return wrapper
+
+
+def call_recorded(item, func, args, options):
+    # func(item, *args) in a worker process under a recorder of its own
+    recorder = Recorder(**options)
+    with recording(recorder):
+        out = func(item, *args)
+    return out, recorder.export()
+
+
+# Writes the recorder's stages as <out_path without extension>.run.json,
+# next to the deck it describes, plus the profiled stage's pstats dump as
+# .prof when one was captured. Returns the manifest's path.
+def write_run_manifest(recorder, out_path, **extra):
+    base = os.path.splitext(out_path)[0]
+    path = base + RUN_SUFFIX
+    manifest = dict(recorder.summary(), output=out_path, **extra)
+    if recorder.profile is not None:
+        manifest['profile'] = {'stage': recorder.profile, 'path': None}
+        if recorder.profiles:
+            stats = pstats.Stats(*recorder.profiles)
+            manifest['profile']['path'] = base + '.prof'
+            stats.dump_stats(manifest['profile']['path'])
+    manifest['stages'] = recorder.stages
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from ReportGen import instrument
+
+
+def default_workers(n_items):
+    return max(1, min(n_items, os.cpu_count() or 1))
+
+
+def map_partitions(func, items, *args, workers=None):
+    # func(item, *args) for every item, in item order; inline when a pool
+    # would not help (func must be a module-level function otherwise)
+    items = list(items)
+    workers = workers or default_workers(len(items))
+    if workers <= 1 or len(items) <= 1:
+        return [func(item, *args) for item in items]
+    recorder = instrument.active()
+    with ProcessPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        if recorder is None:
+            return list(pool.map(func, items, *[repeat(a) for a in args]))
+        # the workers record their stages and hand them back with the results
+        options = {'trace_memory': recorder.trace_memory, 'profile': recorder.profile}
+        results = []
+        for out, exported in pool.map(instrument.call_recorded, items, repeat(func),
+                                      repeat(args), repeat(options)):
+            recorder.absorb(exported)
+            results.append(out)
+        return results
+
+
+def tree_reduce(func, items):
+    items = list(items)
+    if not items:
+        return None
+    while len(items) > 1:
+        merged = [func(a, b) for a, b in zip(items[::2], items[1::2])]
+        if len(items) % 2:
+            merged.append(items[-1])
+        items = merged
+    return items[0]
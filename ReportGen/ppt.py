@@ -1,5 +1,19 @@
+import copy
+import io
+import os
+import pandas as pd
+import pptx
 from pptx import Presentation
+from pptx.chart.axis import ValueAxis
+from pptx.chart.data import CategoryChartData
+from pptx.dml.color import RGBColor
+from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION, XL_TICK_LABEL_POSITION
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls, qn
 from pptx.util import Inches, Pt, Emu
+from ReportGen.images import image_sizes, load_image
+from ReportGen.instrument import instrumented
+from ReportGen.prep import box_summary, is_box_summary
 
 
 def gen_test_layout_file(master):
@@ -30,6 +44,54 @@ def gen_test_layout_file(master):
     prs.save('slide_layouts_file.pptx')
 
 
+# A .pptx template read and parsed once: layouts are looked up by name and
+# each layout's placeholders map name -> idx, so a spec may name a placeholder
+# or give its idx. New presentations are opened from the bytes held in memory,
+# so the template file is read only once, and the object pickles to worker
+# processes as bytes plus the two maps.
+class Template():
+    _layout_names = {
+        'title': 'Title Slide',
+        'blank': 'Title and Content',
+        'text': 'Title and Content',
+        'two_columns': 'Comparison',
+    }
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(
+            os.path.dirname(pptx.__file__), 'templates', 'default.pptx')
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+
+        prs = self.new()
+        self.layouts = {layout.name: i for i, layout in enumerate(
+            prs.slide_layouts)}
+        self.placeholders = {
+            layout.name: {ph.name: ph.placeholder_format.idx
+                          for ph in layout.placeholders}
+            for layout in prs.slide_layouts}
+
+    def new(self):
+        return Presentation(io.BytesIO(self.data))
+
+    def layout(self, prs, slide_layout):
+        name = self._layout_names.get(slide_layout, slide_layout)
+        if name not in self.layouts:
+            raise ValueError('Unknown slide layout {!r}; expected one of {} or a layout of {}: {}'.format(
+                slide_layout, ', '.join(self._layout_names), self.path, ', '.join(self.layouts)))
+        return prs.slide_layouts[self.layouts[name]]
+
+    def placeholder_idx(self, slide, placehold_num):
+        # placehold_num is a placeholder name or idx of the slide's layout
+        names = self.placeholders[slide.slide_layout.name]
+        idx = names.get(placehold_num, placehold_num)
+        if idx not in names.values():
+            raise ValueError('Unknown placeholder {!r} on layout {!r}; expected one of: {}'.format(
+                placehold_num, slide.slide_layout.name,
+                ', '.join('{} ({})'.format(n, i) for n, i in names.items())))
+        return idx
+
+
 class SlideSelect():
     _left = Inches(1.5)
     _top = Inches(2)
@@ -39,36 +101,41 @@ class SlideSelect():
     def __init__(self, out_file, templ_path=None):
         self.out_file = out_file
 
-        if templ_path != None:
-            self.pptx = Presentation(templ_path)
+        # templ_path may also be a Template shared across reports
+        if isinstance(templ_path, Template):
+            self.template = templ_path
         else:
-            self.pptx = Presentation()
+            self.template = Template(templ_path)
+        self.pptx = self.template.new()
 
+    @instrumented
     def save_file(self):
         self.pptx.save(self.out_file)
 
+    def image_sizes(self):
+        return image_sizes(self.pptx)
+
     def _set_layout(self, slide_layout):
-        if slide_layout == 'title':
-            return self.pptx.slide_layouts[0]
-        elif slide_layout == 'blank':
-            return self.pptx.slide_layouts[1]
-        elif slide_layout == 'text':
-            return self.pptx.slide_layouts[1]
-        elif slide_layout == 'two_columns':
-            return self.pptx.slide_layouts[4]
-        else:
-            return
+        return self.template.layout(self.pptx, slide_layout)
 
+    @instrumented
     def create_slide(self, slide_type, slide_layout, **kwargs):
         layout = self._set_layout(slide_layout)
         if slide_type == 'title':
-            return TitleSlide(self.pptx)
+            slide = TitleSlide(self.pptx, layout)
         elif slide_type == 'summary':
-            return SummarySlide(self.pptx, layout)
+            slide = SummarySlide(self.pptx, layout)
         elif slide_type == 'charts':
-            return ChartSlide(self.pptx, layout)
+            slide = ChartSlide(self.pptx, layout)
+        elif slide_type == 'native_chart':
+            slide = NativeChartSlide(self.pptx, layout)
         elif slide_type == 'datatable':
-            return DataSlide(self.pptx, layout)
+            slide = DataSlide(self.pptx, layout)
+        else:
+            return None
+        # placeholders are resolved through the template's name -> idx maps
+        slide.template = self.template
+        return slide
 
     @ staticmethod
     def _set_title(slide, label, fontsize):
@@ -77,20 +144,47 @@ class SlideSelect():
         title.text_frame.paragraphs[0].font.size = Pt(fontsize)
         return title
 
-    @ staticmethod
-    def _set_subtitle(slide, label, placehold_num, fontsize):
-        subtitle = slide.placeholders[placehold_num]
+    def _placeholder(self, slide, placehold_num):
+        # one pruned from a continuation slide is cloned back from the layout
+        idx = self.template.placeholder_idx(slide, placehold_num)
+        try:
+            return slide.placeholders[idx]
+        except KeyError:
+            slide.shapes.clone_placeholder(
+                slide.slide_layout.placeholders.get(idx=idx))
+            return slide.placeholders[idx]
+
+    def _set_subtitle(self, slide, label, placehold_num, fontsize):
+        subtitle = self._placeholder(slide, placehold_num)
         subtitle.text = label
         subtitle.text_frame.paragraphs[0].font.size = Pt(fontsize)
         return subtitle
 
+    def _take_placeholder(self, slide, placehold_num):
+        # native charts and tables take the place of a content placeholder,
+        # given by name or idx, and keep its area
+        placeholder = self._placeholder(slide, placehold_num)
+        dim = [placeholder.left, placeholder.top,
+               placeholder.width, placeholder.height]
+        placeholder.element.getparent().remove(placeholder.element)
+        return dim
+
     def _add_image(self, slide, img_path, left, top):
+        # img_path may also be an in-memory buffer from Chart.save(); files
+        # are read once per process (see images.load_image)
+        if hasattr(img_path, 'seek'):
+            img_path.seek(0)
+        else:
+            img_path = load_image(img_path)
         img = slide.shapes.add_picture(img_path, left, top)
         return img
 
 
 class TitleSlide(SlideSelect):
-    def __init__(self, ppt_obj):
+    def __init__(self, ppt_obj, add_layout=None):
+        # the template's own first slide, added when it has none
+        if len(ppt_obj.slides) == 0:
+            ppt_obj.slides.add_slide(add_layout or ppt_obj.slide_layouts[0])
         self.slide = ppt_obj.slides[0]
 
     def _set_title(self, label, fontsize=30):
@@ -105,6 +199,7 @@ class TitleSlide(SlideSelect):
         top = Inches(dimensions[1])
         img = super()._add_image(self.slide, path, left, top)
 
+    @instrumented
     def create(self, **kwargs):
         label = kwargs.get('label', '')
         sub_label = kwargs.get('sub_label', '')
@@ -127,10 +222,12 @@ class SummarySlide(SlideSelect):
         super()._set_title(self.slide, label, fontsize)
 
     def _set_summary(self, text, placehold_num):
-        summary = self.slide.placeholders[placehold_num]
+        summary = self.slide.placeholders[self.template.placeholder_idx(
+            self.slide, placehold_num)]
         summary.text = text
         summary.text_frame.paragraphs[0].font.size = Pt(14)
 
+    @instrumented
     def create(self, **kwargs):
         label = kwargs.get('label', '')
         text = kwargs.get('text', '')
@@ -155,6 +252,7 @@ class ChartSlide(SlideSelect):
         return super()._add_image(self.slide, path,
                                   left, top)
 
+    @instrumented
     def create(self, path, **kwargs):
         label = kwargs.get('label', '')
         dim = kwargs.get('dim', [self._left, self._top])
@@ -162,9 +260,214 @@ class ChartSlide(SlideSelect):
         img = self._add_chart(path, dim, **kwargs)
 
 
+# Editable PowerPoint charts drawn from the same frames the Bar, Line and Box
+# charts take: no figure is rendered or encoded, PowerPoint draws them itself.
+class NativeChartSlide(SlideSelect):
+    _colors = ['1F77B4', 'FF7F0E', '2CA02C', 'D62728', '9467BD', '8C564B']
+
+    def __init__(self, ppt_obj, add_layout):
+        self.slide = ppt_obj.slides.add_slide(add_layout)
+
+    def _set_title(self, label, fontsize=30):
+        super()._set_title(self.slide, label, fontsize)
+
+    @staticmethod
+    def _values(series):
+        return [None if pd.isna(v) else v for v in series]
+
+    @staticmethod
+    def _categories(data, x):
+        if isinstance(x, str):
+            return list(data[x])
+        return list(x)
+
+    def _line_data(self, data, x, y, **kwargs):
+        selector_col = kwargs.get('selector_col', None)
+        y_list = kwargs.get('y_list', None)
+        chart_data = CategoryChartData(number_format='#,##0')
+        if selector_col is not None:
+            wide = data.pivot_table(
+                index=x, columns=selector_col, values=y, aggfunc='mean', observed=True)
+            selectors = kwargs.get('idx_data', None)
+            selectors = wide.columns if selectors is None else selectors
+            chart_data.categories = list(wide.index)
+            for selector in selectors:
+                chart_data.add_series(str(selector), self._values(wide[selector]))
+        elif y_list is not None:
+            leg_lab_list = kwargs.get('leg_lab_list', y_list)
+            chart_data.categories = self._categories(data, x)
+            for var, label in zip(y_list, leg_lab_list):
+                chart_data.add_series(label, self._values(data[var]))
+        else:
+            chart_data.categories = self._categories(data, x)
+            chart_data.add_series(y, self._values(data[y]))
+        return chart_data
+
+    @staticmethod
+    def _box_data(summary):
+        # stacked segments: hidden offset, whisker, box below and above the
+        # median, whisker
+        chart_data = CategoryChartData(number_format='#,##0')
+        chart_data.categories = [str(c) for c in summary.index]
+        segments = [('', summary['whislo']),
+                    ('Lower whisker', summary['q1'] - summary['whislo']),
+                    ('Q1 - Median', summary['med'] - summary['q1']),
+                    ('Median - Q3', summary['q3'] - summary['med']),
+                    ('Upper whisker', summary['whishi'] - summary['q3'])]
+        for name, values in segments:
+            chart_data.add_series(name, list(values))
+        return chart_data
+
+    @staticmethod
+    def _set_axis_title(axis, label):
+        if label:
+            axis.axis_title.text_frame.text = label
+            axis.axis_title.text_frame.paragraphs[0].font.size = Pt(12)
+
+    @staticmethod
+    def _set_fill(series, color):
+        if color is None:
+            series.format.fill.background()
+        else:
+            series.format.fill.solid()
+            series.format.fill.fore_color.rgb = RGBColor.from_string(color)
+
+    def _move_to_secondary(self, chart, y_lab):
+        # python-pptx has no combo charts: the last bar series is moved into
+        # a line chart plotted against its own value axis on the right
+        plot_area = chart._chartSpace.chart.plotArea
+        bar_chart = plot_area.find(qn('c:barChart'))
+        ser = bar_chart.findall(qn('c:ser'))[-1]
+        bar_chart.remove(ser)
+        for invert in ser.findall(qn('c:invertIfNegative')):
+            ser.remove(invert)
+        ser.insert(ser.index(ser.find(qn('c:tx'))) + 1, parse_xml(
+            '<c:marker %s><c:symbol val="none"/></c:marker>' % nsdecls('c')))
+        ser.append(parse_xml('<c:smooth %s val="0"/>' % nsdecls('c')))
+
+        cat_ax_id, val_ax_id = '60000001', '60000002'
+        line_chart = parse_xml(
+            '<c:lineChart %s><c:grouping val="standard"/><c:varyColors val="0"/>'
+            '<c:marker val="1"/><c:axId val="%s"/><c:axId val="%s"/></c:lineChart>'
+            % (nsdecls('c'), cat_ax_id, val_ax_id))
+        line_chart.insert(2, ser)
+        bar_chart.addnext(line_chart)
+
+        val_ax = plot_area.findall(qn('c:valAx'))[-1]
+        cat_ax = copy.deepcopy(plot_area.find(qn('c:catAx')))
+        cat_ax.find(qn('c:axId')).set('val', cat_ax_id)
+        cat_ax.find(qn('c:crossAx')).set('val', val_ax_id)
+        cat_ax.find(qn('c:delete')).set('val', '1')
+        sec_ax = copy.deepcopy(val_ax)
+        sec_ax.find(qn('c:axId')).set('val', val_ax_id)
+        sec_ax.find(qn('c:crossAx')).set('val', cat_ax_id)
+        sec_ax.find(qn('c:axPos')).set('val', 'r')
+        for gridlines in sec_ax.findall(qn('c:majorGridlines')):
+            sec_ax.remove(gridlines)
+        crosses = sec_ax.find(qn('c:crosses'))
+        if crosses is None:
+            crosses = parse_xml('<c:crosses %s/>' % nsdecls('c'))
+            sec_ax.find(qn('c:crossAx')).addnext(crosses)
+        crosses.set('val', 'max')
+        val_ax.addnext(cat_ax)
+        cat_ax.addnext(sec_ax)
+
+        self._set_axis_title(ValueAxis(sec_ax), y_lab)
+        return chart.plots[1].series[0]
+
+    def _add_chart(self, chart_type, chart_data, dimensions):
+        left, top, width, height = dimensions
+        frame = self.slide.shapes.add_chart(
+            chart_type, left, top, width, height, chart_data)
+        chart = frame.chart
+        chart.font.size = Pt(11)
+        return chart
+
+    @instrumented
+    def create(self, data, kind, x=None, y=None, **kwargs):
+        label = kwargs.get('label', '')
+        x_lab = kwargs.get('x_lab', '')
+        y_lab = kwargs.get('y_lab', '')
+        placehold_num = kwargs.get('placehold_num', 1)
+        colors = kwargs.get('m_colors', self._colors)
+        self._set_title(label)
+        dim = kwargs.get('dim', None) or self._take_placeholder(
+            self.slide, placehold_num)
+
+        if kind == 'bar':
+            chart_data = CategoryChartData(number_format='#,##0')
+            chart_data.categories = self._categories(data, x)
+            chart_data.add_series(y, self._values(data[y]))
+            chart = self._add_chart(
+                XL_CHART_TYPE.COLUMN_CLUSTERED, chart_data, dim)
+            self._set_fill(chart.series[0], kwargs.get('color', colors[0]))
+            chart.has_legend = False
+        elif kind == 'line':
+            chart = self._add_chart(
+                XL_CHART_TYPE.LINE, self._line_data(data, x, y, **kwargs), dim)
+            for series, color in zip(chart.series, colors):
+                series.smooth = False
+                series.format.line.width = Pt(1.25)
+                series.format.line.color.rgb = RGBColor.from_string(color)
+            chart.has_legend = len(chart.series) > 1
+        elif kind == 'combo':
+            y2 = kwargs.get('y2')
+            chart_data = CategoryChartData(number_format='#,##0')
+            chart_data.categories = self._categories(data, x)
+            chart_data.add_series(y, self._values(data[y]))
+            chart_data.add_series(y2, self._values(data[y2]))
+            chart = self._add_chart(
+                XL_CHART_TYPE.COLUMN_CLUSTERED, chart_data, dim)
+            line = self._move_to_secondary(chart, kwargs.get('y2_lab', ''))
+            self._set_fill(chart.series[0], kwargs.get('color', 'D3D3D3'))
+            line.format.line.color.rgb = RGBColor.from_string(
+                kwargs.get('color2', 'FF0000'))
+            line.format.line.width = Pt(1.25)
+            chart.has_legend = False
+        elif kind == 'box':
+            # Box.plot(x, y) convention: x is the value, y the group column;
+            # data may already be a prep.box_summary
+            summary = data if is_box_summary(data) else box_summary(
+                data, y, x, kwargs.get('whis', 1.5))
+            chart = self._add_chart(
+                XL_CHART_TYPE.BAR_STACKED, self._box_data(summary), dim)
+            chart.plots[0].gap_width = 80
+            box_color = kwargs.get('color', colors[0])
+            for series, color in zip(chart.series, [None, 'BFBFBF', box_color, box_color, 'BFBFBF']):
+                self._set_fill(series, color)
+                if color is not None:
+                    series.format.line.color.rgb = RGBColor(0xFF, 0xFF, 0xFF)
+            chart.category_axis.reverse_order = True
+            chart.has_legend = False
+        else:
+            raise ValueError('Unknown native chart kind {!r}'.format(kind))
+
+        if kind == 'box':
+            self._set_axis_title(chart.value_axis, x_lab)
+            self._set_axis_title(chart.category_axis, y_lab)
+        else:
+            self._set_axis_title(chart.category_axis, x_lab)
+            self._set_axis_title(chart.value_axis, y_lab)
+        chart.category_axis.tick_label_position = XL_TICK_LABEL_POSITION.LOW
+        chart.value_axis.has_major_gridlines = False
+        if chart.has_legend:
+            chart.legend.position = XL_LEGEND_POSITION.BOTTOM
+            chart.legend.include_in_layout = False
+        self.chart = chart
+        return chart
+
+
 class DataSlide(SlideSelect):
+    _header_color = '40466E'
+    _row_colors = ['F1F1F2', 'FFFFFF']
+    _row_height = Inches(0.3)
+
     def __init__(self, ppt_obj, add_layout):
         self.slide = ppt_obj.slides.add_slide(add_layout)
+        self.ppt_obj = ppt_obj
+        self.layout = add_layout
+        self.pages = [self.slide]
+        self.tables = []
 
     def _set_title(self, label, fontsize=30):
         super()._set_title(self.slide, label, fontsize)
@@ -182,9 +485,73 @@ class DataSlide(SlideSelect):
         return super()._add_image(self.slide, path,
                                   left, top)
 
-    def _change_table_width(self):
-        pass
-
+    def _page(self, i, label):
+        # continuation slides are shared by every table placed on this slide
+        while len(self.pages) <= i:
+            slide = self.ppt_obj.slides.add_slide(self.layout)
+            super()._set_title(slide, '{} (cont.)'.format(label), 30)
+            self.pages.append(slide)
+        return self.pages[i]
+
+    def _prune_pages(self):
+        # continuation slides only carry the title, subtitles and tables;
+        # placeholders left empty are removed (and cloned back if a later
+        # table needs them)
+        for slide in self.pages[1:]:
+            for placeholder in list(slide.placeholders):
+                if placeholder.placeholder_format.idx == 0:
+                    continue
+                if not placeholder.has_text_frame or not placeholder.text_frame.text:
+                    placeholder.element.getparent().remove(placeholder.element)
+
+    def _fill_table(self, table, header, rows, font_size):
+        colors = [RGBColor.from_string(self._header_color)] + [
+            RGBColor.from_string(c) for c in self._row_colors]
+        for i, values in enumerate([header] + rows):
+            color = colors[0] if i == 0 else colors[1 + i % len(self._row_colors)]
+            for cell, value in zip(table.rows[i].cells, values):
+                cell.text = str(value)
+                cell.fill.solid()
+                cell.fill.fore_color.rgb = color
+                # an empty value leaves the paragraph without a run to style
+                paragraph = cell.text_frame.paragraphs[0]
+                run = paragraph.runs[0] if paragraph.runs else paragraph.add_run()
+                font = run.font
+                font.size = Pt(font_size)
+                if i == 0:
+                    font.bold = True
+                    font.color.rgb = RGBColor(0xFF, 0xFF, 0xFF)
+
+    def _add_table(self, data, placehold_num, subtitle=None, **kwargs):
+        label = kwargs.get('label', '')
+        font_size = kwargs.get('font_size', 12)
+        row_height = kwargs.get('row_height', self._row_height)
+        header = list(data.columns)
+        values = data.to_numpy().tolist()
+
+        tables = []
+        start = 0
+        rows_per_slide = kwargs.get('rows_per_slide', None)
+        while not tables or start < len(values):
+            slide = self._page(len(tables), label)
+            if tables and subtitle is not None:
+                super()._set_subtitle(slide, subtitle[0], subtitle[1], 20)
+            left, top, width, height = self._take_placeholder(
+                slide, placehold_num)
+            if rows_per_slide is None:
+                rows_per_slide = max(1, int(height / row_height) - 1)
+            rows = values[start:start + rows_per_slide]
+            table = slide.shapes.add_table(
+                len(rows) + 1, len(header), left, top, width, row_height * (len(rows) + 1)).table
+            table.horz_banding = False
+            for column in table.columns:
+                column.width = int(width / len(header))
+            self._fill_table(table, header, rows, font_size)
+            tables.append(table)
+            start += len(rows)
+        return tables
+
+    @instrumented
     def create(self, append_dim=True, **kwargs):
         label = kwargs.get('label', '')
         sub_label = kwargs.get('sub_label', '')
@@ -193,12 +560,21 @@ class DataSlide(SlideSelect):
         dim = kwargs.get('dim', [self._left, self._top])
         self._set_title(label)
 
+        subtitle = None
         for key, table_prop in kwargs.get('table_props').items():
             if key == 'subtitle_prop':
+                subtitle = table_prop
                 self._set_subtitle(table_prop[0], table_prop[1])
 
+            if key == 'native_table_prop':
+                # [DataFrame, content placeholder]: a pptx table, paginated
+                # over continuation slides past rows_per_slide
+                self.tables.extend(self._add_table(
+                    table_prop[0], table_prop[1], subtitle, **kwargs))
+
             if key == 'table_prop':
                 img = self._add_table_img(
                     table_prop[0], dim, append_dim, *table_prop[1])
                 if label == 'Top Product and Class Revenue':
                     img.width = img.width - Emu(1000000)
+        self._prune_pages()
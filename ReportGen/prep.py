@@ -1,132 +1,360 @@
 import pandas as pd
 import numpy as np
 import os
+import re
+from ReportGen.cache import CACHE_DIR, ColumnarCache, filter_rows
+from ReportGen.engine import AGGFUNCS, aggregate
+from ReportGen.instrument import instrumented
+from ReportGen.parallel import map_partitions
+from ReportGen.quantiles import GroupSummary
+from ReportGen.rolling import rolling_means
+from ReportGen.topk import top_k
 
 
-def consolidate_data(file_root):
-    data_folder = os.path.join(os.getcwd(), 'data')
+KEY_COLS = ['PRODUCT_NAME', 'PRODUCT_CLASS', 'PRODUCT_CATEGORY', 'CUSTOMER_ID']
+SORT_COLS = ['TX_DATE', 'CUSTOMER_ID']
+
+
+@instrumented
+def read_workbook(path, cache=None, compact=False, filters=None):
+    if cache is None:
+        df = filter_rows(pd.read_excel(path, engine='openpyxl'), filters)
+    else:
+        df = cache.read_excel(
+            path, categories=KEY_COLS if compact else None, filters=filters)
+    return compact_frame(df) if compact else df
+
+
+# The transforms below never modify the caller's frame: they work on a
+# shallow copy (copy(deep=False)), whose column assignments replace columns
+# of the copy only, so no column data is duplicated.
+@instrumented
+def concat_frames(data):
+    data = [d.copy(deep=False) for d in data]
+    for col in data[0].columns:
+        if pd.api.types.is_categorical_dtype(data[0][col]):
+            cats = data[0][col].cat.categories
+            for d in data[1:]:
+                cats = cats.union(d[col].cat.categories)
+            for d in data:
+                d[col] = d[col].cat.set_categories(cats)
+    return pd.concat(data, ignore_index=True)
+
+
+def partition_key(file_name):
+    # YYYYMM encoded in names like tx_data_202103.xlsx
+    match = re.search(r'(?<!\d)(\d{6})(?!\d)', os.path.basename(file_name))
+    return int(match.group(1)) if match else None
+
+
+def data_files(file_root, data_folder=None, start=None, end=None):
+    data_folder = data_folder or os.path.join(os.getcwd(), 'data')
     files = pd.Series(os.listdir(data_folder), name='Document')
-    file_filter = files.str.contains(file_root)
-    data = [pd.read_excel(os.path.join(data_folder, f), engine='openpyxl')
-            for f in files[file_filter]]
+    files = sorted(files[files.str.contains(file_root)])
+    if start is not None or end is not None:
+        start = int(start) if start is not None else 0
+        end = int(end) if end is not None else 999999
+        files = [f for f in files if partition_key(f) is not None
+                 and start <= partition_key(f) <= end]
+    return [os.path.join(data_folder, f) for f in files]
+
+
+def class_filter(mapper, classes):
+    # PRODUCT_CLASS only exists after the mapper join; push it down as names
+    names = mapper.loc[mapper['PRODUCT_CLASS'].isin(classes), 'PRODUCT_NAME']
+    return {'PRODUCT_NAME': set(names)}
+
+
+@instrumented
+def consolidate_data(file_root, use_cache=True, compact=False, start=None, end=None, filters=None):
+    data_folder = os.path.join(os.getcwd(), 'data')
+    cache = ColumnarCache(os.path.join(data_folder, CACHE_DIR)
+                          ) if use_cache else None
+    data = [read_workbook(f, cache, compact, filters)
+            for f in data_files(file_root, data_folder, start, end)]
     if len(data) > 1:
-        return pd.concat(data).reset_index(drop=True)
+        return concat_frames(data)
     elif len(data) == 1:
         return data[0]
     else:
         return 'No data with the suggested file root name found.'
 
 
-def generate_features(df):
-    tmp = df.copy()
+@instrumented
+def compact_frame(df, key_cols=KEY_COLS):
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if col in key_cols:
+            if not pd.api.types.is_categorical_dtype(df[col]):
+                df[col] = df[col].astype('category')
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
+# Per-column dtype, deep memory use in bytes and share of the frame's total,
+# with a TOTAL row: where the RAM of a (compacted) frame goes.
+def memory_report(df):
+    usage = df.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({'dtype': df.dtypes.astype(str), 'bytes': usage})
+    report['pct'] = report['bytes'] / report['bytes'].sum() * 100
+    report.loc['TOTAL'] = ['', usage.sum(), 100.0]
+    return report
+
+
+@instrumented
+def attach_mapper(df, mapper, on='PRODUCT_NAME', compact=False):
+    # resolve each distinct key once, then broadcast by integer code
+    if pd.api.types.is_categorical_dtype(df[on]):
+        codes, uniques = df[on].cat.codes.to_numpy(), df[on].cat.categories
+    else:
+        codes, uniques = pd.factorize(df[on])
+    lookup = mapper.drop_duplicates(on).set_index(on).reindex(uniques)
+    df = df.copy(deep=False)
+    for col in lookup.columns:
+        values = lookup[col]
+        if compact:
+            values = values.astype('category')
+            df[col] = pd.Categorical.from_codes(np.where(
+                codes < 0, -1, values.cat.codes.to_numpy()[codes]), values.cat.categories)
+        else:
+            df[col] = values.reset_index(drop=True).reindex(codes).to_numpy()
+    return df
+
+
+def _product(a, b):
+    # widen first so downcast columns cannot overflow
+    return np.multiply(a.to_numpy(), b.to_numpy(), dtype=np.result_type(a.dtype, b.dtype, np.int64))
+
+
+@instrumented
+def generate_features(df, sort=True):
+    tmp = df.copy(deep=False)
     tmp['TX_DATE'] = pd.to_datetime(tmp['TX_DATE'])
     tmp['TX_YER'] = tmp['TX_DATE'].dt.year
     tmp['TX_MTH'] = tmp['TX_DATE'].dt.month
     tmp['TX_DAY'] = tmp['TX_DATE'].dt.day
-    tmp['TOT_REV'] = tmp['PRICE'] * tmp['QTY']
-    tmp['TOT_COST'] = tmp['PURCH_COST'] * tmp['QTY']
+    tmp['TOT_REV'] = _product(tmp['PRICE'], tmp['QTY'])
+    tmp['TOT_COST'] = _product(tmp['PURCH_COST'], tmp['QTY'])
     tmp['NET_SALES'] = tmp['TOT_REV'] - tmp['TOT_COST']
-    tmp.sort_values(['TX_DATE', 'CUSTOMER_ID'], inplace=True)
-    tmp.reset_index(drop=True, inplace=True)
+    if sort:
+        tmp = sort_partition(tmp)
     return tmp
 
 
+def _order_codes(series):
+    if pd.api.types.is_categorical_dtype(series) or series.dtype == object:
+        return pd.factorize(series, sort=True)[0]
+    return series.to_numpy().view('i8') if pd.api.types.is_datetime64_dtype(series) else series.to_numpy()
+
+
+def is_sorted(df, by=SORT_COLS):
+    if len(df) < 2:
+        return True
+    ok = np.zeros(len(df) - 1, dtype=bool)
+    tied = np.ones(len(df) - 1, dtype=bool)
+    for col in by:
+        diff = np.diff(_order_codes(df[col]))
+        ok |= tied & (diff > 0)
+        tied &= diff == 0
+    return bool((ok | tied).all())
+
+
+@instrumented
+def sort_partition(df, by=SORT_COLS):
+    if is_sorted(df, by):
+        return df.reset_index(drop=True)
+    return df.sort_values(by, kind='mergesort', ignore_index=True)
+
+
+def _bounds(df, by):
+    return tuple(df[by].iloc[0]), tuple(df[by].iloc[-1])
+
+
+def _merge_order(keys, sizes):
+    # row order merging the sorted runs of keys (consecutive, of the given
+    # sizes): runs are merged pairwise, as a balanced tree of log2(k) rounds
+    # of linear two-way merges; on ties the earlier run comes first
+    bounds = np.cumsum([0] + sizes)
+    runs = [(np.arange(lo, hi), keys[lo:hi]) for lo, hi in zip(bounds, bounds[1:])]
+    while len(runs) > 1:
+        merged = []
+        for (rows_a, keys_a), (rows_b, keys_b) in zip(runs[0::2], runs[1::2]):
+            at_a = np.arange(len(keys_a)) + np.searchsorted(keys_b, keys_a, side='left')
+            at_b = np.arange(len(keys_b)) + np.searchsorted(keys_a, keys_b, side='right')
+            rows = np.empty(len(rows_a) + len(rows_b), dtype=np.int64)
+            out = np.empty(len(rows), dtype=keys.dtype)
+            rows[at_a], rows[at_b] = rows_a, rows_b
+            out[at_a], out[at_b] = keys_a, keys_b
+            merged.append((rows, out))
+        if len(runs) % 2:
+            merged.append(runs[-1])
+        runs = merged
+    return runs[0][0]
+
+
+@instrumented
+def merge_sorted(parts, by=SORT_COLS):
+    # k-way merge of individually sorted partitions: a plain concat when the
+    # key ranges do not overlap (monthly files), otherwise a merge of the
+    # runs on one integer key per row (see _merge_order)
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return pd.DataFrame()
+    parts.sort(key=lambda p: _bounds(p, by)[0])
+    bounds = [_bounds(p, by) for p in parts]
+    merged = concat_frames(parts) if len(parts) > 1 else parts[0]
+    if all(hi <= nxt[0] for (_, hi), nxt in zip(bounds, bounds[1:])):
+        return merged
+    codes = [_order_codes(merged[col]) for col in by]
+    codes = [c - c.min() for c in codes]
+    sizes = [int(c.max()) + 1 for c in codes]
+    if np.prod(sizes, dtype=float) < 2 ** 63:
+        order = _merge_order(np.ravel_multi_index(codes, sizes), [len(p) for p in parts])
+    else:
+        # keys too wide for one integer: a stable sort of the runs instead
+        order = np.lexsort(codes[::-1])
+    return merged.take(order).reset_index(drop=True)
+
+
+def sorted_partition(path, use_cache=True, compact=False, filters=None):
+    cache = ColumnarCache(os.path.join(os.path.dirname(path), CACHE_DIR)
+                          ) if use_cache else None
+    return generate_features(read_workbook(path, cache, compact, filters))
+
+
+@instrumented
+def consolidate_sorted(file_root, use_cache=True, compact=False, workers=None, start=None, end=None, filters=None):
+    parts = map_partitions(sorted_partition, data_files(file_root, start=start, end=end),
+                           use_cache, compact, filters, workers=workers)
+    return merge_sorted(parts)
+
+
+@instrumented
 def get_grouped(df, cat, cols, aggfunc):
-    tmp = df.copy()
-    return tmp.groupby(cat)[cols].agg(aggfunc)
+    if aggfunc in AGGFUNCS:
+        return aggregate(df, [(cat, cols, aggfunc)])[(cat, aggfunc)]
+    return df.groupby(cat)[cols].agg(aggfunc)
 
 
+@instrumented
 def calculate_ma(df, col, window):
-    tmp = df.copy().reset_index()
-    idx_col = tmp.columns[0]
-    tmp[col + '_MA_' + str(window)] = tmp[col].rolling(window).mean()
-    return tmp.set_index(idx_col)
+    return df.join(rolling_means(df, [col], [window]))
 
 
+@instrumented
 def group_process(df):
-    gp_prod_sum = get_grouped(
-        df, 'PRODUCT_NAME', ['TOT_REV', 'TOT_COST', 'NET_SALES'], 'sum')
-    gp_prod_avg = get_grouped(
-        df, 'PRODUCT_NAME', ['TOT_REV', 'TOT_COST', 'NET_SALES'], 'mean')
-    gp_class_sum = get_grouped(df, 'PRODUCT_CLASS', [
-                               'TOT_REV', 'TOT_COST', 'NET_SALES'], 'sum')
-    gp_class_avg = get_grouped(df, 'PRODUCT_CLASS', [
-                               'TOT_REV', 'TOT_COST', 'NET_SALES'], 'mean')
-    gp_date = get_grouped(
-        df, 'TX_DATE', ['TOT_REV', 'TOT_COST', 'NET_SALES', 'QTY'], 'sum')
-    gp_mth = get_grouped(
-        df, 'TX_MTH', ['TOT_REV', 'TOT_COST', 'NET_SALES'], 'sum')
-    gp_day = get_grouped(
-        df, 'TX_DAY', ['TOT_REV', 'TOT_COST', 'NET_SALES'], 'sum')
+    cols = ['TOT_REV', 'TOT_COST', 'NET_SALES']
+    res = aggregate(df, [
+        ('PRODUCT_NAME', cols, ['sum', 'mean']),
+        ('PRODUCT_CLASS', cols, ['sum', 'mean']),
+        ('TX_DATE', cols + ['QTY'], 'sum'),
+        ('TX_MTH', cols, 'sum'),
+        ('TX_DAY', cols, 'sum'),
+    ])
+    gp_prod_sum = res[('PRODUCT_NAME', 'sum')]
+    gp_prod_avg = res[('PRODUCT_NAME', 'mean')]
+    gp_class_sum = res[('PRODUCT_CLASS', 'sum')]
+    gp_class_avg = res[('PRODUCT_CLASS', 'mean')]
+    gp_date = res[('TX_DATE', 'sum')]
+    gp_mth = res[('TX_MTH', 'sum')]
+    gp_day = res[('TX_DAY', 'sum')]
     return gp_prod_sum, gp_prod_avg, gp_class_sum, gp_class_avg, gp_date, gp_mth, gp_day
 
 
+@instrumented
 def ma_process(df):
-    tmp = calculate_ma(df, 'TOT_REV', 7)
-    tmp = calculate_ma(tmp, 'TOT_REV', 30)
-    tmp = calculate_ma(tmp, 'QTY', 7)
-    tmp = calculate_ma(tmp, 'QTY', 30)
-    return tmp
+    # 7/30 calendar-day means; a day without transactions counts as zero
+    return df.join(rolling_means(df, ['TOT_REV', 'QTY'], [7, 30]))
 
 
-def top_process(main, prod_avg, class_avg):
-    top_10_prods = prod_avg['NET_SALES'].sort_values(
-        ascending=False).head(10).reset_index()
-    top_10_classes = class_avg['NET_SALES'].sort_values(
-        ascending=False).head(10).reset_index()
+@instrumented
+def top_means(avg, col='NET_SALES', top=10):
+    return top_k(avg[col], top).reset_index()
 
-    gp_prod_cnt = get_grouped(main, 'PRODUCT_NAME', ['NET_SALES'], 'count').rename(
-        columns={'NET_SALES': 'PROD_CNT'})
-    gp_class_cnt = get_grouped(main, 'PRODUCT_CLASS', ['NET_SALES'], 'count').rename(
-        columns={'NET_SALES': 'PROD_CNT'})
-    gp_class_cnt['PROD_CNT_PCT'] = gp_class_cnt['PROD_CNT'] / \
-        gp_class_cnt['PROD_CNT'].sum() * 100
 
-    # top 10 products
-    top_10_prod_cnt = gp_prod_cnt[gp_prod_cnt.index.isin(
-        top_10_prods['PRODUCT_NAME'])]
-    top_10_prods2 = top_10_prods.merge(
-        top_10_prod_cnt, how='left', on='PRODUCT_NAME')
+@instrumented
+def with_counts(table, cnt, on):
+    # table's rows with their PROD_CNT and its share of the total in percent
+    cnt = cnt.assign(PROD_CNT_PCT=cnt['PROD_CNT'] / cnt['PROD_CNT'].sum() * 100)
+    return table.merge(cnt[cnt.index.isin(table[on])], how='left', on=on)
+
 
-    # top 10 classes
-    top_10_class_cnt = gp_class_cnt[gp_class_cnt.index.isin(
-        top_10_classes['PRODUCT_CLASS'])]
-    top_10_classes2 = top_10_classes.merge(
-        top_10_class_cnt, how='left', on='PRODUCT_CLASS')
+@instrumented
+def top_tables(prod_avg, class_avg, gp_class_cnt, top=10):
+    top_10_prods = top_means(prod_avg, top=top)
+    top_10_classes = top_means(class_avg, top=top)
+    top_10_classes2 = with_counts(top_10_classes, gp_class_cnt, 'PRODUCT_CLASS')
+    return top_10_prods, top_10_classes, top_10_classes2
+
+
+@instrumented
+def top_process(main, prod_avg, class_avg):
+    res = aggregate(main, [
+        ('PRODUCT_CLASS', ['NET_SALES'], 'count'),
+        ('PRODUCT_CLASS', ['TOT_COST'], 'sum'),
+    ])
+    gp_class_cnt = res[('PRODUCT_CLASS', 'count')].rename(
+        columns={'NET_SALES': 'PROD_CNT'})
+    top_10_prods, top_10_classes, top_10_classes2 = top_tables(
+        prod_avg, class_avg, gp_class_cnt)
 
     # top 10 product costs
-    top_10_prod_cost_idx = main[['PRODUCT_CLASS', 'TOT_COST']].groupby(
-        'PRODUCT_CLASS').sum().sort_values('TOT_COST', ascending=False).head(10).index
-    top_10_prod_cost = main[main['PRODUCT_CLASS'].isin(top_10_prod_cost_idx)][[
+    top_10_prod_cost = top_cost_rows(res[('PRODUCT_CLASS', 'sum')], main)
+    return top_10_prods, top_10_classes, top_10_classes2, top_10_prod_cost
+
+
+def top_cost_classes(class_cost_sum, top=10):
+    return top_k(class_cost_sum, top, 'TOT_COST').index
+
+
+@instrumented
+def top_cost_rows(class_cost_sum, cost_rows, top=10):
+    idx = top_cost_classes(class_cost_sum, top)
+    rows = cost_rows[cost_rows['PRODUCT_CLASS'].isin(idx)][[
         'PRODUCT_CLASS', 'TOT_COST']]
+    if pd.api.types.is_categorical_dtype(rows['PRODUCT_CLASS']):
+        rows['PRODUCT_CLASS'] = np.asarray(rows['PRODUCT_CLASS'])
+    return rows
 
-    # top 10 customer revenue
-    top_10_cust_rev = main.groupby('CUSTOMER_ID').sum(
-    )[['QTY', 'NET_SALES']].sort_values('NET_SALES', ascending=False).head(10)
 
-    # top 10 customer purchases
-    top_10_cust_purch = main.groupby('CUSTOMER_ID').sum(
-    )[['QTY', 'NET_SALES']].sort_values('QTY', ascending=False).head(10)
-    return top_10_prods, top_10_classes, top_10_classes2, top_10_prod_cost
+@instrumented
+def top_class_series(class_cnt, class_daily, top=3):
+    idx = top_k(class_cnt, top, 'PRODUCT_CATEGORY').index
+    large_class = class_daily[class_daily.index.get_level_values(
+        'PRODUCT_CLASS').isin(idx)].reset_index()
+    return idx, large_class
 
 
+@instrumented
 def gen_top_cost_data(df, top=10):
-    idx = df[['PRODUCT_CLASS', 'TOT_COST']].groupby('PRODUCT_CLASS').sum(
-    ).sort_values('TOT_COST', ascending=False).head(top).index
-    prod_cost = df[df['PRODUCT_CLASS'].isin(
-        idx)][['PRODUCT_CLASS', 'TOT_COST']]
-    return prod_cost
+    return top_cost_rows(get_grouped(df, 'PRODUCT_CLASS', ['TOT_COST'], 'sum'), df, top)
 
 
+@instrumented
 def gen_top_time_series(df, top=3):
-    idx = df.groupby('PRODUCT_CLASS').count().sort_values(
-        'PRODUCT_CATEGORY', ascending=False).head(top).index
-    large_class = df[df['PRODUCT_CLASS'].isin(idx)].groupby(
-        ['TX_DATE', 'PRODUCT_CLASS']).sum()['QTY'].reset_index()
+    res = aggregate(df, [
+        ('PRODUCT_CLASS', ['PRODUCT_CATEGORY'], 'count'),
+        (['TX_DATE', 'PRODUCT_CLASS'], ['QTY'], 'sum'),
+    ])
     # top_10_large_class = top_10_large_class.assign(ALPHA=top_10_large_class['PRODUCT_CLASS'].map(class_alpha_map))
-    return idx, large_class
+    return top_class_series(res[('PRODUCT_CLASS', 'count')],
+                            res[(('TX_DATE', 'PRODUCT_CLASS'), 'sum')]['QTY'], top)
+
+
+@instrumented
+def box_summary(df, by, col, whis=1.5, max_fliers=100):
+    # per-group boxplot statistics of the rows, groups in order of appearance
+    # (see GroupSummary.box_stats)
+    return GroupSummary.from_rows(df, by, col, capacity=None).box_stats(
+        whis=whis, max_fliers=max_fliers)
+
+
+def is_box_summary(data):
+    return {'q1', 'med', 'q3', 'whislo', 'whishi'}.issubset(getattr(data, 'columns', ()))
 
 
+@instrumented
 def gen_top_name_class_tables(df, col_to_int, rename_dict):
     tmp = df.copy()
     tmp[col_to_int] = tmp[col_to_int].astype(int)
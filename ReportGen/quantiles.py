@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+# values kept per group before the group is compacted
+SUMMARY_POINTS = 1024
+BOX_STATS = ['q1', 'med', 'q3', 'whislo', 'whishi', 'count', 'fliers', 'nfliers']
+
+
+def _halve(values, weights):
+    # averages neighbouring pairs of sorted values, weighted; the smallest
+    # and largest value are kept as they are
+    inner_v, inner_w = values[1:-1], weights[1:-1]
+    n = len(inner_v) // 2 * 2
+    w = inner_w[0:n:2] + inner_w[1:n:2]
+    v = (inner_v[0:n:2] * inner_w[0:n:2] + inner_v[1:n:2] * inner_w[1:n:2]) / w
+    return (np.concatenate([values[:1], v, inner_v[n:], values[-1:]]),
+            np.concatenate([weights[:1], w, inner_w[n:], weights[-1:]]))
+
+
+def _quantiles(values, weights, qs):
+    # linear interpolation between the centre ranks of the (sorted) values,
+    # the same as Series.quantile when every weight is 1
+    cum = np.cumsum(weights)
+    ranks = cum - weights + (weights - 1) / 2
+    return np.interp(np.asarray(qs) * (cum[-1] - 1), ranks, values)
+
+
+def _spaced(n, k):
+    # positions of k of n sorted values, evenly spaced, both ends included
+    rank = np.arange(n)
+    if k is None or n <= k:
+        return rank
+    step = max(n - 1, 1) / max(k - 1, 1)
+    return rank[np.round(np.round(rank / step) * step) == rank]
+
+
+# Mergeable summary of a value column per group (e.g. TOT_COST per
+# PRODUCT_CLASS), enough to draw a boxplot of every group. A group keeps its
+# values exactly, as (value, weight) points, until it holds more than
+# `capacity` of them; then neighbouring values are averaged pairwise until it
+# fits, its minimum and maximum kept as they are, so its size no longer
+# follows the row count. first holds each group's earliest order key (row
+# position by default) to list groups in order of appearance.
+class GroupSummary():
+    def __init__(self, by, col, points=None, first=None, capacity=SUMMARY_POINTS):
+        self.by = by
+        self.col = col
+        self.points = points if points is not None else pd.DataFrame(
+            {by: pd.Series(dtype=object), col: pd.Series(dtype=float), 'weight': pd.Series(dtype=np.int64)})
+        self.first = first if first is not None else pd.DataFrame(
+            {'row': pd.Series(dtype=np.int64)}, index=pd.Index([], name=by))
+        self.capacity = capacity
+
+    # order is a dict of key columns (e.g. TX_DATE and CUSTOMER_ID) that
+    # rank the rows ahead of their position; positions count from start, so
+    # chunks of one source summarised apart keep their rows in source order.
+    @classmethod
+    def from_rows(cls, df, by, col, order=None, start=0, capacity=SUMMARY_POINTS):
+        mask = (df[by].notna() & df[col].notna()).to_numpy()
+        groups = np.asarray(df[by])[mask]
+        points = pd.DataFrame({by: groups, col: df[col].to_numpy()[mask],
+                               'weight': np.ones(mask.sum(), dtype=np.int64)})
+        keys = {k: np.asarray(v)[mask] for k, v in (order or {}).items()}
+        keys['row'] = start + np.flatnonzero(mask)
+        first = pd.DataFrame(dict(keys, **{by: groups}))
+        summary = cls(by, col, points, capacity=capacity)
+        summary.first = summary._first(first)
+        return summary._compact()
+
+    def _first(self, first):
+        keys = [c for c in first.columns if c != self.by]
+        first = first.reset_index() if self.by not in first.columns else first
+        first = first.sort_values(keys, kind='mergesort').drop_duplicates(self.by)
+        return first.set_index(self.by)[keys]
+
+    def copy(self):
+        # merge() replaces points and first rather than changing them
+        return GroupSummary(self.by, self.col, self.points, self.first, self.capacity)
+
+    def merge(self, other):
+        self.points = pd.concat([self.points, other.points], ignore_index=True)
+        self.first = self._first(pd.concat([self.first, other.first]))
+        return self._compact()
+
+    def _compact(self):
+        if self.capacity is None:
+            return self
+        sizes = self.points[self.by].value_counts()
+        over = sizes.index[sizes > self.capacity]
+        if not len(over):
+            return self
+        full = self.points[self.by].isin(over).to_numpy()
+        parts = [self.points[~full]]
+        for group, pts in self.points[full].groupby(self.by, sort=False):
+            pts = pts.sort_values(self.col, kind='mergesort')
+            values = pts[self.col].to_numpy(dtype=float)
+            weights = pts['weight'].to_numpy()
+            while len(values) > self.capacity:
+                values, weights = _halve(values, weights)
+            parts.append(pd.DataFrame({self.by: group, self.col: values, 'weight': weights}))
+        self.points = pd.concat(parts, ignore_index=True)
+        return self
+
+    def groups(self):
+        # in order of first appearance
+        return list(self.first.index)
+
+    # Per-group quartiles, Tukey whiskers and outliers (what a boxplot draws)
+    # of groups (all of them by default), in order of appearance. Groups with
+    # more than max_fliers outliers keep an evenly spaced sample of them,
+    # always including both extremes.
+    def box_stats(self, groups=None, whis=1.5, max_fliers=100):
+        wanted = set(self.groups() if groups is None else groups)
+        order = [g for g in self.groups() if g in wanted]
+        points = self.points[self.points[self.by].isin(order)].sort_values(
+            [self.by, self.col], kind='mergesort')
+        rows = {}
+        for group, pts in points.groupby(self.by, sort=False):
+            values = pts[self.col].to_numpy()
+            weights = pts['weight'].to_numpy()
+            q1, med, q3 = _quantiles(values, weights, [0.25, 0.5, 0.75])
+            lo, hi = q1 - whis * (q3 - q1), q3 + whis * (q3 - q1)
+            outside = (values < lo) | (values > hi)
+            fliers = values[outside]
+            rows[group] = {'q1': q1, 'med': med, 'q3': q3,
+                           'whislo': values[values >= lo].min(),
+                           'whishi': values[values <= hi].max(),
+                           'count': weights.sum(),
+                           'fliers': tuple(fliers[_spaced(len(fliers), max_fliers)]),
+                           'nfliers': weights[outside].sum()}
+        stats = pd.DataFrame.from_dict(rows, orient='index', columns=BOX_STATS).reindex(order)
+        stats.index.name = self.by
+        return stats
@@ -0,0 +1,222 @@
+import hashlib
+import importlib.metadata
+import importlib.util
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+from ReportGen.cache import CACHE_DIR
+from ReportGen.parallel import map_partitions
+
+
+RENDER_CACHE_BYTES = 256 * 2 ** 20
+RENDER_CACHE_AGE = 30 * 24 * 3600
+
+
+# A chart to render: the chart class with its constructor arguments, the
+# arguments for plot() and save() (image size, resolution and encoding), and
+# optionally a twinned chart drawn on the combo axis returned by this one
+# (e.g. a Line over a Bar). None paths are dropped, so a job with no paths
+# is only rendered to a buffer.
+class ChartJob():
+    def __init__(self, chart_cls, row_dim, col_dim, data, *paths, **kwargs):
+        self.chart_cls = chart_cls
+        self.args = (row_dim, col_dim, data) + tuple(
+            p for p in paths if p is not None)
+        self.kwargs = kwargs
+        self.plot_args = ()
+        self.plot_kwargs = {}
+        self.save_kwargs = {}
+        self.combo = None
+
+    def plot(self, *args, **kwargs):
+        self.plot_args = args
+        self.plot_kwargs = kwargs
+        return self
+
+    def save(self, **kwargs):
+        self.save_kwargs = kwargs
+        return self
+
+    def twin(self, job):
+        self.combo = job
+        return self
+
+    @property
+    def paths(self):
+        return list(self.args[3:])
+
+
+def render_job(job):
+    # charts draw on pooled Agg figures of their own (see charts.FigurePool),
+    # released here whether or not the render succeeds
+    with job.chart_cls(*job.args, **job.kwargs) as chart:
+        out = chart.plot(*job.plot_args, **job.plot_kwargs)
+        if job.combo is not None:
+            twin = job.combo.chart_cls(*job.combo.args, **job.combo.kwargs)
+            twin.plot(*job.combo.plot_args, combo_ax=out[1],
+                      **job.combo.plot_kwargs)
+        return chart.save(**job.save_kwargs)
+
+
+def _feed(sha, obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        if isinstance(obj, pd.DataFrame):
+            header = (list(obj.columns), [str(t) for t in obj.dtypes])
+        else:
+            header = (obj.name, str(obj.dtype))
+        sha.update(repr((type(obj).__name__, header)).encode())
+        sha.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, pd.Index):
+        sha.update(repr(('Index', obj.name, str(obj.dtype))).encode())
+        sha.update(pd.util.hash_pandas_object(obj).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        # repr() elides long arrays; object arrays hold pointers, so their
+        # items are fed one by one instead of their bytes
+        sha.update(repr(('ndarray', str(obj.dtype), obj.shape)).encode())
+        if obj.dtype.hasobject:
+            for item in obj.ravel():
+                _feed(sha, item)
+        else:
+            sha.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for k in sorted(obj, key=repr):
+            sha.update(repr(k).encode())
+            _feed(sha, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        sha.update('{}:{}'.format(type(obj).__name__, len(obj)).encode())
+        for item in obj:
+            _feed(sha, item)
+    elif isinstance(obj, type):
+        sha.update('{}.{}'.format(obj.__module__, obj.__qualname__).encode())
+    else:
+        sha.update(repr(obj).encode())
+
+
+# code besides a chart's own module, and the libraries, that shape the
+# rendered bytes (module name, distribution name)
+RENDER_MODULES = ['ReportGen.images', 'ReportGen.downsample']
+RENDER_LIBRARIES = ['matplotlib', 'seaborn', 'Pillow', 'numpy']
+
+_code_versions = {}
+
+
+def _library_version(dist):
+    try:
+        return importlib.metadata.version(dist)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _code_version(chart_cls):
+    # editing the code that draws a chart, or upgrading a library it draws
+    # with, must invalidate its entries; nothing is imported to find out
+    module = chart_cls.__module__
+    if module not in _code_versions:
+        sha = hashlib.sha1()
+        for name in [module] + RENDER_MODULES:
+            with open(importlib.util.find_spec(name).origin, 'rb') as f:
+                sha.update(f.read())
+        sha.update(repr([(dist, _library_version(dist)) for dist in RENDER_LIBRARIES]).encode())
+        _code_versions[module] = sha.hexdigest()
+    return _code_versions[module]
+
+
+def job_key(job):
+    sha = hashlib.sha256()
+    while job is not None:
+        _feed(sha, [job.chart_cls, _code_version(job.chart_cls),
+                    job.args[:3], job.kwargs, job.plot_args, job.plot_kwargs,
+                    job.save_kwargs])
+        job = job.combo
+    return sha.hexdigest()
+
+
+def job_file(job):
+    # the cache entry's file name: job_key plus the extension of the format
+    # the job is saved in
+    fmt = job.save_kwargs.get('fmt', 'png').lower()
+    return '{}.{}'.format(job_key(job), 'jpg' if fmt in ('jpeg', 'jpg') else fmt)
+
+
+# Rendered images addressed by job_file (chart type, code and libraries,
+# data, figure size, plot and save kwargs). Entries past max_age are dropped
+# and the least recently used ones go once the directory exceeds max_bytes.
+class RenderCache():
+    def __init__(self, cache_dir=None, max_bytes=RENDER_CACHE_BYTES, max_age=RENDER_CACHE_AGE):
+        self.cache_dir = cache_dir or os.path.join(
+            os.getcwd(), 'img', CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        os.utime(path)
+        return data
+
+    def put(self, key, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # several report builders may share one cache directory
+        tmp_path = '{}.{}.tmp'.format(self._path(key), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+    def evict(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+                if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.max_bytes is None or total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# Renders the jobs on a process pool with the Agg backend and returns one
+# image buffer per job, in job order. Jobs given paths also write them. With
+# a cache, jobs whose key is already stored are not rendered at all.
+def render_charts(jobs, workers=None, cache=None):
+    jobs = list(jobs)
+    if cache is None:
+        return map_partitions(render_job, jobs, workers=workers)
+
+    keys = [job_file(job) for job in jobs]
+    results = [cache.get(key) for key in keys]
+    misses = [i for i, data in enumerate(results) if data is None]
+    rendered = map_partitions(
+        render_job, [jobs[i] for i in misses], workers=workers)
+    for i, buffer in zip(misses, rendered):
+        results[i] = buffer.getvalue()
+        cache.put(keys[i], results[i])
+    for i, data in enumerate(results):
+        if i not in misses:
+            for path in jobs[i].paths:
+                with open(path, 'wb') as f:
+                    f.write(data)
+    cache.evict()
+    return [io.BytesIO(data) for data in results]
@@ -0,0 +1,43 @@
+import os
+from ReportGen import instrument
+from ReportGen.render import render_charts
+from ReportGen.spec import ReportGraph, assemble_slides, deck_slides, load_spec, slide_needs
+
+
+# Builds the deck a report spec describes (report.json by default, see
+# spec.py) from an Aggregates total (the whole dataset or one segment of it)
+# and saves it to out_path. Only the data nodes and charts its slides use are
+# computed. label defaults to the spec's.
+# template is the .pptx template's path or a ppt.Template. The logos are read
+# from img_folder. Charts go into the deck from memory; with write_images they
+# are also exported there as PNGs. native_charts picks the slides drawn as
+# PowerPoint charts and tables over the ones rendered with matplotlib. Returns
+# the slide count and the size of every picture in the deck (see
+# images.image_sizes).
+def build_report(agg, out_path, template, label=None, img_folder=None, write_images=False, native_charts=False, workers=None, cache=None, spec=None):
+    spec = spec or load_spec()
+    img_folder = img_folder or os.path.join(os.getcwd(), 'img')
+    slides = deck_slides(spec, native_charts)
+    data, charts = slide_needs(slides, spec.get('charts', {}))
+
+    #### Process Data ####
+    graph = ReportGraph(spec, {'agg': agg})
+    with instrument.stage('report_data'):
+        graph.compute(data, workers=workers, stage=instrument.stage)
+
+    #### Generate charts ####
+    def img_path(name):
+        return os.path.join(img_folder, name) if write_images else None
+
+    jobs = [graph.chart_job(name, img_path, spec.get('image')) for name in charts]
+    # with a cache, unchanged charts are not re-rendered
+    with instrument.stage('render_charts'):
+        buffers = render_charts(jobs, workers=workers, cache=cache)
+    images = dict(zip(charts, buffers))
+
+    #### Copy to pptx ####
+    with instrument.stage('assemble_report'):
+        report = assemble_slides(slides, graph, images, out_path, template,
+                                 label or spec['label'], img_folder)
+    report.save_file()
+    return {'slides': len(report.pptx.slides), 'images': report.image_sizes()}
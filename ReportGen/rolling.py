@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+
+def ma_name(col, window):
+    return col + '_MA_' + str(window)
+
+
+# Trailing means over calendar windows (e.g. 7 and 30 days) of a frame
+# indexed by date. Days missing from the index, like NaN values, count as
+# zero, so a window always spans `window` calendar days; the first window - 1
+# days are NaN. Every column and window comes from one cumulative sum over the
+# dense calendar. update() takes days after the last one seen and computes
+# only those, carrying the last max(windows) running totals forward.
+class RollingMeans():
+    def __init__(self, columns, windows, freq='D'):
+        self.columns = list(columns)
+        self.windows = sorted(windows)
+        self.freq = freq
+        self.end = None
+        self.days = 0
+        self.tail = np.zeros((1, len(self.columns)), dtype=np.int64)
+        self.frame = None
+
+    def _dense(self, df):
+        df = df[self.columns].fillna(0).sort_index()
+        start = df.index[0] if self.end is None else self.end + to_offset(self.freq)
+        if df.index[0] < start:
+            raise ValueError('RollingMeans.update only takes days after {}'.format(self.end))
+        calendar = pd.date_range(start, df.index[-1], freq=self.freq, name=df.index.name)
+        return df.groupby(level=0).sum().reindex(calendar, fill_value=0)
+
+    def update(self, df):
+        if len(df) == 0:
+            return pd.DataFrame(columns=[ma_name(c, w) for c in self.columns for w in self.windows])
+        dense = self._dense(df)
+        values = dense.to_numpy()
+        # integer sums stay exact until a float column or update promotes
+        # them; tail holds the running totals before the first new day,
+        # newest last
+        dtype = np.int64 if values.dtype.kind in 'iub' and self.tail.dtype.kind == 'i' else float
+        tail = self.tail.astype(dtype)
+        cum = np.concatenate(
+            [tail, tail[-1] + np.cumsum(values.astype(dtype), axis=0)])
+        n = len(dense)
+        offset = len(cum) - n
+        pos = np.arange(n) + self.days
+
+        data = {}
+        for i, col in enumerate(self.columns):
+            for window in self.windows:
+                lagged = np.arange(n) + offset - window
+                means = np.full(n, np.nan)
+                ok = (pos + 1 >= window) & (lagged >= 0)
+                means[ok] = (cum[offset:, i][ok] - cum[lagged[ok], i]) / window
+                data[ma_name(col, window)] = means
+        out = pd.DataFrame(data, index=dense.index)
+
+        self.tail = cum[-self.windows[-1]:]
+        self.days += n
+        self.end = dense.index[-1]
+        self.frame = out if self.frame is None else pd.concat([self.frame, out])
+        return out
+
+
+def rolling_means(df, columns, windows, freq='D'):
+    return RollingMeans(columns, windows, freq).update(df)
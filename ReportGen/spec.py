@@ -0,0 +1,222 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from datetime import datetime
+from ReportGen.charts import Bar, Box, Line, Table
+from ReportGen.parallel import default_workers
+from ReportGen.ppt import SlideSelect
+from ReportGen.prep import gen_top_name_class_tables, ma_process, top_means, with_counts
+from ReportGen.render import ChartJob
+from ReportGen.state import Aggregates
+
+
+# A report spec (JSON, or YAML with PyYAML installed) names three kinds of
+# node:
+#   data    {"op": <OPS key>, "inputs": [<ref>, ...], "params": {...}}, run as
+#           OPS[op](*inputs, **params); the sources (e.g. "agg") are given
+#   charts  {"chart": <CHARTS key>, "size": [w, h], "data": <ref>,
+#            "options": {...}, "plot": {"args": [...], "kwargs": {...}},
+#            "twin": <chart drawn on the combo axis>, "file": <image name>,
+#            "width": <inches the picture is shown at on its slide>}
+#   slides  [{"slide": <type>, "layout": <layout>, "charts": "raster"|"native",
+#             "create": [{"args": [...], "kwargs": {...}}, ...]}, ...]
+# A <ref> is a node name followed by attributes or item positions, e.g.
+# "ma.index" or "top_series.0". Inside arguments, {"$ref": <ref>} is a data
+# value, {"$chart": name} a rendered chart, {"$image": file} a file in the
+# image folder, {"$date": format} today's date and {"$label": true} the
+# deck's label. Slides without "charts" are in every deck. The top-level
+# "image" options (format, colors, quality, ppi) apply to every raster
+# chart; a chart's "width" sets the resolution it is rendered at (see
+# images.chart_dpi) and, through the image's ppi, its size on the slide.
+SPEC_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'report.json')
+
+
+def _sums(agg, key):
+    return agg.sums[key]
+
+
+OPS = {
+    'sums': _sums,
+    'means': Aggregates.means,
+    'counts': Aggregates.product_counts,
+    'cost_box': Aggregates.cost_box,
+    'top_series': Aggregates.top_time_series,
+    'moving_averages': ma_process,
+    'top': top_means,
+    'with_counts': with_counts,
+    'table': gen_top_name_class_tables,
+}
+CHARTS = {'Bar': Bar, 'Box': Box, 'Line': Line, 'Table': Table}
+
+
+def load_spec(path=SPEC_FILE):
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _node(ref):
+    return ref.split('.', 1)[0]
+
+
+def refs(value, key='$ref'):
+    # names of the nodes value refers to through {key: ...}
+    if isinstance(value, dict):
+        if key in value:
+            return {_node(value[key]) if key == '$ref' else value[key]}
+        return set().union(*[refs(v, key) for v in value.values()])
+    if isinstance(value, (list, tuple)):
+        return set().union(*[refs(v, key) for v in value])
+    return set()
+
+
+def _chart_refs(chart):
+    # data nodes a chart spec (and its twin) draws from
+    names = {_node(chart['data'])} | refs(chart.get('options', {})) | refs(chart.get('plot', {}))
+    if 'twin' in chart:
+        names |= _chart_refs(chart['twin'])
+    return names
+
+
+# The data nodes of a spec as a dependency graph over the given sources
+# (e.g. {'agg': Aggregates}). compute() runs only the nodes asked for and
+# what they depend on, each once: results are kept for later calls.
+class ReportGraph():
+    def __init__(self, spec, sources):
+        self.nodes = spec.get('data', {})
+        self.charts = spec.get('charts', {})
+        self.values = dict(sources)
+        for name, node in self.nodes.items():
+            if '.' in name:
+                raise ValueError('Data node names cannot contain dots: {!r}'.format(name))
+            if node['op'] not in OPS:
+                raise ValueError('Unknown op {!r} in data node {!r}'.format(node['op'], name))
+        for name, chart in self.charts.items():
+            if chart['chart'] not in CHARTS:
+                raise ValueError('Unknown chart {!r} in chart {!r}'.format(chart['chart'], name))
+
+    def deps(self, name):
+        node = self.nodes[name]
+        return {_node(ref) for ref in node.get('inputs', [])} | refs(node.get('params', {}))
+
+    def plan(self, names):
+        # the nodes to run for names, each after the ones it depends on
+        order, visiting = [], set()
+
+        def visit(name, path):
+            if name in self.values or name in order:
+                return
+            if name not in self.nodes:
+                raise ValueError('Unknown data node {!r} (needed by {})'.format(
+                    name, ' -> '.join(path) or 'the report'))
+            if name in visiting:
+                raise ValueError('Data nodes depend on each other: {}'.format(
+                    ' -> '.join(path + [name])))
+            visiting.add(name)
+            for dep in sorted(self.deps(name)):
+                visit(dep, path + [name])
+            visiting.discard(name)
+            order.append(name)
+
+        for name in sorted(names):
+            visit(name, [])
+        return order
+
+    def value(self, ref):
+        name, *path = ref.split('.')
+        value = self.values[name]
+        for part in path:
+            value = value[int(part)] if part.isdigit() else getattr(value, part)
+        return value
+
+    def resolve(self, value, specials=None):
+        # value with every {"$ref": ...} (and any of specials' keys) replaced
+        specials = dict(specials or {}, **{'$ref': self.value})
+        if isinstance(value, dict):
+            for key, func in specials.items():
+                if key in value:
+                    return func(value[key])
+            return {k: self.resolve(v, specials) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(v, specials) for v in value]
+        return value
+
+    def _run(self, name, stage):
+        node = self.nodes[name]
+        with stage('data:' + name):
+            return OPS[node['op']](*[self.value(ref) for ref in node.get('inputs', [])],
+                                   **self.resolve(node.get('params', {})))
+
+    # Computes names and what they need, independent nodes on a thread pool
+    # (workers=1 runs them here, in plan order). stage(name) wraps every node
+    # as data:<name>, e.g. to time it; see bench.Timings and instrument.stage.
+    def compute(self, names, workers=None, stage=nullcontext):
+        order = self.plan(names)
+        workers = workers or default_workers(len(order))
+        if workers <= 1 or len(order) <= 1:
+            for name in order:
+                self.values[name] = self._run(name, stage)
+            return
+        waiting = {name: self.deps(name) - set(self.values) for name in order}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            while waiting or running:
+                for name in [n for n, deps in waiting.items() if not deps]:
+                    del waiting[name]
+                    running[pool.submit(self._run, name, stage)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.values[name] = future.result()
+                    for deps in waiting.values():
+                        deps.discard(name)
+
+    def chart_job(self, name, img_path=lambda name: None, image=None):
+        chart = self.charts[name]
+        job = self._job(chart, img_path(chart['file']) if 'file' in chart else None)
+        save = dict(image or {})
+        if 'width' in chart:
+            save['width'] = chart['width']
+        return job.save(**save)
+
+    def _job(self, chart, path=None):
+        job = ChartJob(CHARTS[chart['chart']], *chart['size'], self.value(chart['data']), path,
+                       **self.resolve(chart.get('options', {})))
+        plot = self.resolve(chart.get('plot', {}))
+        job.plot(*plot.get('args', []), **plot.get('kwargs', {}))
+        if 'twin' in chart:
+            job.twin(self._job(chart['twin']))
+        return job
+
+
+def deck_slides(spec, native_charts=False):
+    kind = 'native' if native_charts else 'raster'
+    return [s for s in spec['slides'] if s.get('charts', kind) == kind]
+
+
+def slide_needs(slides, charts):
+    # (data nodes, charts) the slides draw from, charts' own data included
+    chart_names = refs(slides, '$chart')
+    unknown = chart_names - set(charts)
+    if unknown:
+        raise ValueError('Unknown charts {}'.format(sorted(unknown)))
+    data = refs(slides).union(*[_chart_refs(charts[name]) for name in chart_names])
+    return data, sorted(chart_names)
+
+
+# Adds the slides to a SlideSelect on template, unsaved. images maps each
+# chart name to its rendered buffer.
+def assemble_slides(slides, graph, images, out_path, template, label, img_folder):
+    report = SlideSelect(out_path, template)
+    specials = {'$chart': images.__getitem__,
+                '$image': lambda name: os.path.join(img_folder, name),
+                '$date': lambda fmt: datetime.now().date().strftime(fmt),
+                '$label': lambda _: label}
+    for slide in slides:
+        page = report.create_slide(slide['slide'], slide['layout'])
+        for call in graph.resolve(slide.get('create', [{}]), specials):
+            page.create(*call.get('args', []), **call.get('kwargs', {}))
+    return report
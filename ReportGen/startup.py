@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+
+# Modules a data-only job (preparation, aggregate export, cache warm-up)
+# imports, the plotting/deck libraries they must not pull in, and the time
+# budget for importing each of them in a fresh interpreter. charts and render
+# belong here too: they load matplotlib only once a chart is drawn.
+LIGHT_MODULES = ['ReportGen.cache', 'ReportGen.downsample', 'ReportGen.engine',
+                 'ReportGen.images', 'ReportGen.instrument', 'ReportGen.parallel',
+                 'ReportGen.prep', 'ReportGen.quantiles', 'ReportGen.rolling', 'ReportGen.state',
+                 'ReportGen.stream', 'ReportGen.topk',
+                 'ReportGen.charts', 'ReportGen.render']
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'pptx']
+IMPORT_BUDGET = 1.5
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))
+'''
+
+
+def import_cost(module):
+    # seconds to import module in a new interpreter started in the repo, and
+    # what it loaded
+    out = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)],
+                         capture_output=True, text=True, check=True, cwd=REPO_DIR).stdout
+    seconds, loaded = json.loads(out.splitlines()[-1])
+    heavy = [m for m in HEAVY_MODULES if m in loaded]
+    return seconds, heavy
+
+
+def check_imports(modules=LIGHT_MODULES, budget=IMPORT_BUDGET):
+    costs = {}
+    errors = []
+    for module in modules:
+        seconds, heavy = import_cost(module)
+        costs[module] = seconds
+        if heavy:
+            errors.append('{} imports {}'.format(module, ', '.join(heavy)))
+        if budget is not None and seconds > budget:
+            errors.append('{} took {:.2f}s to import (budget {:.2f}s)'.format(
+                module, seconds, budget))
+    if errors:
+        raise RuntimeError('Import budget exceeded: ' + '; '.join(errors))
+    return costs
+
+
+if __name__ == '__main__':
+    for module, seconds in check_imports().items():
+        print('{:<20} {:.3f}s'.format(module, seconds))
@@ -0,0 +1,329 @@
+import hashlib
+import os
+import pandas as pd
+from ReportGen.cache import CACHE_DIR, ColumnarCache, content_hash, file_signature
+from ReportGen.engine import aggregate
+from ReportGen.instrument import instrumented
+from ReportGen.parallel import map_partitions, tree_reduce
+from ReportGen.prep import KEY_COLS, attach_mapper, compact_frame, data_files, generate_features, read_workbook, top_class_series, top_cost_classes, top_tables
+from ReportGen.quantiles import GroupSummary
+from ReportGen.topk import top_k
+
+
+STATE_FILE = 'aggregate_state.pkl'
+# per-workbook Aggregates, next to the state file
+PARTITION_DIR = 'partitions'
+# states of another version are rebuilt from the workbooks
+STATE_VERSION = 3
+SUM_COLS = ['TOT_REV', 'TOT_COST', 'NET_SALES']
+GROUPINGS = {
+    'PRODUCT_NAME': SUM_COLS,
+    'PRODUCT_CLASS': SUM_COLS,
+    'TX_DATE': SUM_COLS + ['QTY'],
+    'TX_MTH': SUM_COLS,
+    'TX_DAY': SUM_COLS,
+    'CUSTOMER_ID': ['QTY', 'NET_SALES'],
+}
+COUNTS = {
+    'PRODUCT_NAME': SUM_COLS,
+    'PRODUCT_CLASS': SUM_COLS + ['PRODUCT_CATEGORY'],
+}
+
+
+def _add(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    dtypes = a.dtypes.to_dict() if isinstance(a, pd.DataFrame) else a.dtype
+    return a.add(b, fill_value=0).astype(dtypes)
+
+
+# Mergeable partial aggregates of a feature frame (after the mapper join).
+# Sums and counts are additive, so partitions fold in any order; means and
+# top-N tables are derived on demand. The boxplot's TOT_COST per class is
+# kept as a GroupSummary, bounded whatever the row count.
+class Aggregates():
+    def __init__(self, sums=None, counts=None, class_daily=None, cost_summary=None, sketches=None):
+        self.sums = sums or {}
+        self.counts = counts or {}
+        self.class_daily = class_daily
+        self.cost_summary = cost_summary
+        # (key, col) -> SpaceSaving, standing in for sums[key] when a key has
+        # too many values to total exactly
+        self.sketches = sketches or {}
+
+    def __setstate__(self, state):
+        state.setdefault('sketches', {})
+        # raw cost rows of older states; AggregateState rebuilds those
+        state.pop('cost_rows', None)
+        state.setdefault('cost_summary', None)
+        self.__dict__.update(state)
+
+    @classmethod
+    @instrumented
+    def from_frame(cls, df, skip=(), start=0):
+        requests = [(key, cols, 'sum')
+                    for key, cols in GROUPINGS.items() if key not in skip]
+        requests += [(key, cols, 'count') for key, cols in COUNTS.items()]
+        requests.append((['TX_DATE', 'PRODUCT_CLASS'], ['QTY'], 'sum'))
+        res = aggregate(df, requests)
+        sums = {key: res[(key, 'sum')] for key in GROUPINGS if key not in skip}
+        counts = {key: res[(key, 'count')] for key in COUNTS}
+        class_daily = res[(('TX_DATE', 'PRODUCT_CLASS'), 'sum')]['QTY']
+        # classes are listed in order of appearance in date order; start is
+        # the position of df's first row in its workbook
+        cost_summary = GroupSummary.from_rows(df, 'PRODUCT_CLASS', 'TOT_COST', order={
+            'TX_DATE': df['TX_DATE'], 'CUSTOMER_ID': df['CUSTOMER_ID']}, start=start)
+        return cls(sums, counts, class_daily, cost_summary)
+
+    @instrumented
+    def merge(self, other):
+        for key in GROUPINGS:
+            self.sums[key] = _add(self.sums.get(key), other.sums.get(key))
+        for key in COUNTS:
+            self.counts[key] = _add(
+                self.counts.get(key), other.counts.get(key))
+        self.class_daily = _add(self.class_daily, other.class_daily)
+        if self.cost_summary is None:
+            if other.cost_summary is not None:
+                self.cost_summary = other.cost_summary.copy()
+        elif other.cost_summary is not None:
+            self.cost_summary.merge(other.cost_summary)
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sketch)
+            else:
+                self.sketches[key] = sketch
+        return self
+
+    def means(self, key):
+        return self.sums[key] / self.counts[key][self.sums[key].columns]
+
+    @instrumented
+    def group_process(self):
+        return (self.sums['PRODUCT_NAME'], self.means('PRODUCT_NAME'),
+                self.sums['PRODUCT_CLASS'], self.means('PRODUCT_CLASS'),
+                self.sums['TX_DATE'], self.sums['TX_MTH'], self.sums['TX_DAY'])
+
+    def product_counts(self, key):
+        return self.counts[key][['NET_SALES']].rename(columns={'NET_SALES': 'PROD_CNT'})
+
+    @instrumented
+    def top_process(self):
+        top_10_prods, top_10_classes, top_10_classes2 = top_tables(
+            self.means('PRODUCT_NAME'), self.means('PRODUCT_CLASS'),
+            self.product_counts('PRODUCT_CLASS'))
+        return top_10_prods, top_10_classes, top_10_classes2, self.cost_box()
+
+    @instrumented
+    def cost_box(self, top=10):
+        # boxplot statistics (see GroupSummary.box_stats) of the top classes
+        # by total cost
+        classes = top_cost_classes(self.sums['PRODUCT_CLASS'][['TOT_COST']], top)
+        return self.cost_summary.box_stats(classes)
+
+    @instrumented
+    def top_time_series(self, top=3):
+        return top_class_series(self.counts['PRODUCT_CLASS'], self.class_daily, top)
+
+    def top_keys(self, key, col='NET_SALES', top=10):
+        # e.g. the top 10 customers by net sales; every key when top is None
+        if self.sums.get(key) is None:
+            # estimated from the sketch (see SpaceSaving.top for the bounds),
+            # which holds at most its capacity of keys
+            sketch = self.sketches[(key, col)]
+            return list(top_k(sketch, len(sketch.counts) if top is None else top).index)
+        sums = self.sums[key][col]
+        if top is not None:
+            sums = top_k(sums, top)
+        return list(sums.index)
+
+    def top_estimates(self, key, col='NET_SALES', top=10):
+        # the top keys with their totals; from a sketch, with the error bounds
+        # of SpaceSaving.top
+        if self.sums.get(key) is None:
+            return self.sketches[(key, col)].top(top)
+        return top_k(self.sums[key][col], top).to_frame('count')
+
+
+def frame_key(df):
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values).hexdigest()
+
+
+@instrumented
+def workbook_frame(path, mapper, use_cache=True, filters=None):
+    cache = ColumnarCache(os.path.join(os.path.dirname(path), CACHE_DIR)
+                          ) if use_cache else None
+    # keep date order: the boxplot lists classes in order of appearance
+    df = generate_features(read_workbook(
+        path, cache, compact=True, filters=filters))
+    return compact_frame(attach_mapper(df, mapper, compact=True))
+
+
+@instrumented
+def aggregate_workbook(path, mapper, use_cache=True, filters=None):
+    return Aggregates.from_frame(workbook_frame(path, mapper, use_cache, filters))
+
+
+def segment_filter(mapper, by, values):
+    # the read filter keeping only rows of the listed values of by, or None
+    # when by is not a workbook or mapper column (e.g. a derived TX_MTH)
+    if by not in KEY_COLS:
+        return None
+    if by in mapper.columns and by != 'PRODUCT_NAME':
+        return {'PRODUCT_NAME': set(mapper['PRODUCT_NAME'][mapper[by].isin(values)])}
+    return {by: values}
+
+
+# Segments with listed values only decode those values' rows from the
+# columnar cache (written when the workbook was first aggregated); segments
+# of every value share one read of the whole workbook.
+@instrumented
+def aggregate_segments(path, mapper, segments, use_cache=True, filters=None):
+    parts = {}
+    whole = None
+    for by, values in segments.items():
+        pushed = segment_filter(mapper, by, values) if values is not None else None
+        if pushed is not None and not set(pushed) & set(filters or {}):
+            df = workbook_frame(path, mapper, use_cache, dict(filters or {}, **pushed))
+        else:
+            if whole is None:
+                whole = workbook_frame(path, mapper, use_cache, filters)
+            df = whole
+        for value, part in df.groupby(by, sort=False, observed=True):
+            if values is None or value in values:
+                parts[(by, value)] = Aggregates.from_frame(part)
+    return parts
+
+
+# Map-reduce over monthly workbooks: each one is read and aggregated in its
+# own worker process, then the partials are merged pairwise.
+def parallel_aggregates(file_root, mapper, workers=None, use_cache=True, start=None, end=None, filters=None):
+    parts = map_partitions(aggregate_workbook, data_files(file_root, start=start, end=end),
+                           mapper, use_cache, filters, workers=workers)
+    return tree_reduce(lambda a, b: a.merge(b), parts)
+
+
+# Aggregates per segment, keyed by (column, value). segments maps a column to
+# the values wanted (None for all of them); every monthly workbook is read
+# from the columnar cache (see aggregate_segments), split on the columns, and
+# the partials merged across workbooks.
+def segment_aggregates(file_root, mapper, segments, workers=None, use_cache=True, start=None, end=None, filters=None):
+    segments = {by: None if values is None else set(values)
+                for by, values in segments.items()}
+    total = {}
+    for parts in map_partitions(aggregate_segments, data_files(file_root, start=start, end=end),
+                                mapper, segments, use_cache, filters, workers=workers):
+        for key, agg in parts.items():
+            if key in total:
+                total[key].merge(agg)
+            else:
+                total[key] = agg
+    return total
+
+
+# Aggregates kept per monthly workbook. New workbooks are folded into the
+# running total; a changed or removed one triggers a re-merge of the stored
+# partials (no workbook is re-read), and a different mapper resets everything.
+# The state file holds the total and each workbook's signature only; the
+# partials are saved one file per workbook under partitions/ and read back
+# for a re-merge alone, so loading the state does not grow with the history.
+class AggregateState():
+    def __init__(self, path=None):
+        self.version = STATE_VERSION
+        self.path = path
+        self.partitions = {}
+        self.mapper_key = None
+        self.total = Aggregates()
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or os.path.join(os.getcwd(), 'data', CACHE_DIR, STATE_FILE)
+        if os.path.exists(path):
+            state = pd.read_pickle(path)
+            if getattr(state, 'version', 1) == STATE_VERSION:
+                state.path = path
+                return state
+        return cls(path)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['partitions'] = {name: {k: v for k, v in part.items() if k != 'agg'}
+                               for name, part in self.partitions.items()}
+        return state
+
+    def _partition_path(self, name):
+        return os.path.join(os.path.dirname(self.path), PARTITION_DIR, name + '.pkl')
+
+    def partition(self, name):
+        # a workbook's Aggregates, from memory until saved, then from its file
+        part = self.partitions[name]
+        if 'agg' in part:
+            return part['agg']
+        return pd.read_pickle(self._partition_path(name))
+
+    def save(self):
+        part_dir = os.path.join(os.path.dirname(self.path), PARTITION_DIR)
+        os.makedirs(part_dir, exist_ok=True)
+        for name, part in self.partitions.items():
+            if 'agg' in part:
+                tmp_path = self._partition_path(name) + '.tmp'
+                pd.to_pickle(part.pop('agg'), tmp_path)
+                os.replace(tmp_path, self._partition_path(name))
+        # partials of workbooks no longer tracked
+        for file_name in os.listdir(part_dir):
+            if file_name[:-len('.pkl')] not in self.partitions:
+                os.remove(os.path.join(part_dir, file_name))
+        tmp_path = self.path + '.tmp'
+        pd.to_pickle(self, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def _is_current(self, name, sig):
+        part = self.partitions.get(name)
+        if part is None:
+            return False
+        if (part['size'], part['mtime_ns']) == (sig['size'], sig['mtime_ns']):
+            return True
+        if part['size'] == sig['size'] and part['sha1'] == content_hash(sig['path']):
+            part.update(sig)
+            return True
+        return False
+
+    @instrumented
+    def update(self, file_root, mapper, use_cache=True, workers=None):
+        paths = {os.path.basename(p): p for p in data_files(file_root)}
+        files = sorted(paths)
+
+        mapper_key = frame_key(mapper)
+        rebuild = mapper_key != self.mapper_key
+        if rebuild:
+            self.partitions = {}
+            self.mapper_key = mapper_key
+        removed = set(self.partitions) - set(files)
+        for name in removed:
+            del self.partitions[name]
+        rebuild = rebuild or bool(removed)
+
+        ingested = []
+        for name in files:
+            sig = file_signature(paths[name])
+            if self._is_current(name, sig):
+                continue
+            rebuild = rebuild or name in self.partitions
+            sig['sha1'] = content_hash(paths[name])
+            self.partitions[name] = sig
+            ingested.append(name)
+        parts = map_partitions(aggregate_workbook, [paths[name] for name in ingested],
+                               mapper, use_cache, workers=workers)
+        for name, agg in zip(ingested, parts):
+            self.partitions[name]['agg'] = agg
+
+        if rebuild:
+            self.total = Aggregates()
+            for name in sorted(self.partitions):
+                self.total.merge(self.partition(name))
+        else:
+            for name in ingested:
+                self.total.merge(self.partitions[name]['agg'])
+        return ingested
@@ -0,0 +1,105 @@
+import os
+import openpyxl
+import pandas as pd
+from ReportGen.cache import CACHE_DIR, ColumnarCache, filter_rows
+from ReportGen.prep import KEY_COLS, attach_mapper, compact_frame, data_files, generate_features
+from ReportGen.state import GROUPINGS, Aggregates
+from ReportGen.topk import SpaceSaving
+
+
+MEMORY_BUDGET = 256 * 2 ** 20
+FIRST_CHUNK_ROWS = 10000
+MIN_CHUNK_ROWS = 1000
+# raw chunk + derived feature/mapper columns + aggregation temporaries
+_WORKING_SET = 4
+# most a chunk may grow over the previous one
+_GROWTH = 2
+
+
+# Rows to read per chunk so that a chunk and what is derived from it stay
+# within memory_budget. Chunks are counted in rows read, before any row
+# filter: the read rows are all held at once, whatever the filter keeps.
+# observe() re-estimates from each processed chunk; chunks that the filter
+# emptied say nothing about row size and keep the last estimate, and the
+# chunk size grows by at most _GROWTH per chunk.
+class ChunkBudget():
+    def __init__(self, memory_budget=MEMORY_BUDGET, first_rows=FIRST_CHUNK_ROWS):
+        self.memory_budget = memory_budget
+        self.rows = first_rows
+        self.peak_bytes = 0
+
+    def observe(self, df):
+        if len(df) == 0:
+            return
+        nbytes = df.memory_usage(index=False, deep=True).sum()
+        self.peak_bytes = max(self.peak_bytes, nbytes)
+        # the processed columns outnumber the read ones, so their bytes per
+        # row bound a read row's from above
+        row_bytes = max(nbytes / len(df), 1)
+        self.rows = max(MIN_CHUNK_ROWS, min(self.rows * _GROWTH, int(
+            self.memory_budget / (row_bytes * _WORKING_SET))))
+
+
+def iter_excel_chunks(path, budget):
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        buf = []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            buf.append(row)
+            if len(buf) >= budget.rows:
+                yield pd.DataFrame.from_records(buf, columns=header)
+                buf = []
+        if buf:
+            yield pd.DataFrame.from_records(buf, columns=header)
+    finally:
+        wb.close()
+
+
+def iter_workbook_chunks(path, budget, cache=None, compact=True, filters=None):
+    chunks = None
+    if cache is not None:
+        chunks = cache.iter_chunks(
+            path, budget, categories=KEY_COLS if compact else None)
+    if chunks is None:
+        chunks = iter_excel_chunks(path, budget)
+    for chunk in chunks:
+        chunk = filter_rows(chunk, filters)
+        yield compact_frame(chunk) if compact else chunk
+
+
+# Folds every matching workbook into one Aggregates chunk by chunk. Peak
+# memory follows memory_budget (plus the O(keys) aggregates themselves, the
+# boxplot's cost summary included). With sketch_capacity, the sketch_keys
+# groupings are not totalled exactly but kept as SpaceSaving sketches of
+# that many counters (see top_keys and top_estimates), losses (negative
+# NET_SALES) in a second sketch of the same size. Chunks are summarised in
+# workbook order with their row offset, so the boxplot lists classes in the
+# same (date, customer, row) order as the batch path.
+def stream_aggregates(file_root, mapper, memory_budget=MEMORY_BUDGET, use_cache=True, start=None, end=None, filters=None, sketch_capacity=None, sketch_keys=('CUSTOMER_ID',)):
+    cache = ColumnarCache(os.path.join(os.getcwd(), 'data', CACHE_DIR)
+                          ) if use_cache else None
+
+    budget = ChunkBudget(memory_budget)
+    total = Aggregates()
+    skip = sketch_keys if sketch_capacity else ()
+    for key in skip:
+        for col in GROUPINGS[key]:
+            total.sketches[(key, col)] = SpaceSaving(sketch_capacity)
+    for path in data_files(file_root, start=start, end=end):
+        offset = 0
+        for chunk in iter_workbook_chunks(path, budget, cache, filters=filters):
+            df = generate_features(chunk, sort=False)
+            df = compact_frame(attach_mapper(df, mapper, compact=True))
+            total.merge(Aggregates.from_frame(df, skip=skip, start=offset))
+            offset += len(df)
+            for (key, col), sketch in total.sketches.items():
+                sketch.update(df[key], df[col])
+            budget.observe(df)
+            del df, chunk
+    return total
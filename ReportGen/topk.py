@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+
+def _top_positions(values, k):
+    # positions of the k largest values, largest first and ties in order of
+    # appearance (as a stable descending sort); NaN sorts last
+    values = np.where(np.isnan(values), -np.inf, values)
+    n = len(values)
+    if k < n:
+        part = np.argpartition(-values, k - 1)[:k]
+        # values equal to the k-th largest may lie outside the partition
+        kth = values[part].min()
+        part = np.union1d(part, np.flatnonzero(values == kth))
+    else:
+        part = np.arange(n)
+    order = np.lexsort((part, -values[part]))
+    return part[order][:k]
+
+
+# Top k of a Series (or of frame[col]) by partial selection instead of a full
+# sort; same rows and order as sort_values(ascending=False).head(k). A
+# SpaceSaving sketch answers the same call from its estimated totals.
+def top_k(obj, k, col=None):
+    if isinstance(obj, SpaceSaving):
+        return obj.top(k)['count']
+    if k <= 0:
+        return obj.iloc[:0]
+    values = obj[col] if col is not None else obj
+    positions = _top_positions(values.to_numpy(dtype=float), k)
+    return obj.iloc[positions]
+
+
+# Heavy hitters of a weighted stream in `capacity` counters (Space-Saving).
+# Every kept total over-estimates the true one by at most its error, and
+# any key not kept totals at most `floor`. Chunks are folded in as exact
+# summaries and sketches merge the same way, so memory stays O(capacity)
+# whatever the number of keys. Space-Saving needs non-negative weights, so
+# negative ones (e.g. loss-making sales) go to a second sketch, `losses`, of
+# the same capacity; a key's loss is known to within that sketch's error
+# (or its floor when not kept there), which widens the key's error in top().
+class SpaceSaving():
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=float)
+        self.errors = pd.Series(dtype=float)
+        self.floor = 0
+        self.total = 0
+        self.losses = None
+
+    def _exact(self, keys, weights):
+        chunk = SpaceSaving(self.capacity)
+        chunk.counts = pd.Series(weights).groupby(keys).sum()
+        chunk.errors = pd.Series(0.0, index=chunk.counts.index)
+        chunk.total = weights.sum()
+        return chunk
+
+    def update(self, keys, weights=None):
+        keys = np.asarray(keys)
+        weights = np.ones(len(keys)) if weights is None else np.asarray(
+            weights, dtype=float)
+        gained, lost = weights > 0, weights < 0
+        chunk = self._exact(keys[gained], weights[gained])
+        if lost.any():
+            chunk.losses = self._exact(keys[lost], -weights[lost])
+        chunk.total = weights.sum()
+        return self.merge(chunk)
+
+    def merge(self, other):
+        keys = self.counts.index.union(other.counts.index)
+        counts = self.counts.reindex(keys, fill_value=self.floor) + \
+            other.counts.reindex(keys, fill_value=other.floor)
+        errors = self.errors.reindex(keys, fill_value=self.floor) + \
+            other.errors.reindex(keys, fill_value=other.floor)
+        floor = self.floor + other.floor
+        if len(counts) > self.capacity:
+            counts = top_k(counts, self.capacity)
+            floor = max(floor, counts.min())
+        self.counts = counts
+        self.errors = errors[counts.index]
+        self.floor = floor
+        self.total += other.total
+        if other.losses is not None:
+            if self.losses is None:
+                self.losses = SpaceSaving(self.capacity)
+            self.losses.merge(other.losses)
+        return self
+
+    def _loss_bounds(self, keys):
+        # lower and upper bounds of the keys' losses
+        if self.losses is None:
+            zero = pd.Series(0.0, index=keys)
+            return zero, zero
+        kept = self.losses.counts.reindex(keys)
+        lower = (kept - self.losses.errors.reindex(keys)).fillna(0)
+        return lower, kept.fillna(self.losses.floor)
+
+    def top(self, k):
+        # upper bounds of the net totals: gains over-estimated, losses under
+        lower, upper = self._loss_bounds(self.counts.index)
+        net = self.counts - lower
+        counts = top_k(net, k)
+        errors = self.errors + upper - lower
+        out = pd.DataFrame({'count': counts, 'error': errors[counts.index]})
+        out['lower'] = out['count'] - out['error']
+        # certainly in the true top k: no other key can total more
+        rest = net.drop(counts.index)
+        runner_up = max(rest.max() if len(rest) else 0, self.floor)
+        out['guaranteed'] = out['lower'] >= runner_up
+        return out
@@ -0,0 +1,66 @@
+import argparse
+import os
+from contextlib import nullcontext
+from ReportGen.batch import build_reports, check_segments
+from ReportGen.instrument import Recorder, add_arguments, options_from_args, recording, write_run_manifest
+from ReportGen.prep import consolidate_data
+from ReportGen.spec import SPEC_FILE, load_spec
+from ReportGen.state import AggregateState
+from ReportGen.stream import MEMORY_BUDGET, stream_aggregates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Build one report per segment, e.g. PRODUCT_CLASS CUSTOMER_ID=10')
+    parser.add_argument('segments', nargs='+',
+                        help='COLUMN for every value, COLUMN=N for the top N by net sales')
+    parser.add_argument('--out', default=os.path.join(os.getcwd(), 'reports'))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--native', action='store_true',
+                        help='draw charts and tables as PowerPoint objects')
+    parser.add_argument('--spec', default=SPEC_FILE,
+                        help='report spec of data, charts and slides (JSON or YAML)')
+    parser.add_argument('--stream', action='store_true',
+                        help='total the data chunk by chunk instead of updating the saved state')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET // 2 ** 20,
+                        help='MB of rows held at once with --stream (default %(default)s)')
+    parser.add_argument('--sketch-capacity', type=int, default=None,
+                        help='with --stream, rank CUSTOMER_ID=N with a sketch of this many counters')
+    add_arguments(parser)
+    args = parser.parse_args()
+    options = options_from_args(args)
+    recorder = Recorder(**options) if options else None
+
+    segments = {}
+    for spec in args.segments:
+        by, _, top = spec.partition('=')
+        segments[by] = int(top) if top else None
+    try:
+        check_segments(segments)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with recording(recorder) if recorder else nullcontext():
+        #### Import Data ####
+        mapper = consolidate_data('map')
+        if args.stream:
+            # COLUMN=N segments of sketched keys are ranked from the sketch
+            total = stream_aggregates('tx_data_', mapper,
+                                      memory_budget=args.memory_budget * 2 ** 20,
+                                      sketch_capacity=args.sketch_capacity)
+        else:
+            state = AggregateState.load()
+            state.update('tx_data_', mapper)
+            state.save()
+            total = state.total
+
+        #### Build decks ####
+        # each deck gets its own run manifest; this run's covers the rest
+        manifest = build_reports('tx_data_', mapper, segments, args.out,
+                                 os.path.join(os.getcwd(), 'design_template.pptx'),
+                                 total=total, workers=args.workers, native_charts=args.native,
+                                 cache_dir=os.path.join(os.getcwd(), 'img', '.cache'),
+                                 instrument=options, spec=load_spec(args.spec))
+    print('Reports listed in {}'.format(manifest))
+    if recorder:
+        print('Run manifest: {}'.format(write_run_manifest(recorder, manifest)))
@@ -0,0 +1,44 @@
+import argparse
+from ReportGen.bench import benchmark, compare, config_key, parse_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Time each stage of the report pipeline on synthetic data, e.g. run 10k 1m')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='benchmark and append to bench/results.jsonl')
+    cmp = sub.add_parser('compare', help='compare two commits stage by stage')
+    for p in (run, cmp):
+        p.add_argument('--products', type=int, default=2500)
+        p.add_argument('--classes', type=int, default=700)
+        p.add_argument('--customers', type=int, default=1000)
+        p.add_argument('--months', type=int, default=12)
+        p.add_argument('--seed', type=int, default=0)
+        p.add_argument('--warm', action='store_true',
+                       help='read workbooks from the columnar cache')
+        p.add_argument('--native', action='store_true',
+                       help='draw charts and tables as PowerPoint objects')
+    run.add_argument('rows', nargs='+', help='row counts such as 10k, 100k, 1m, 10m')
+    run.add_argument('--repeat', type=int, default=3)
+    cmp.add_argument('--rows', default='100k')
+    cmp.add_argument('base', nargs='?', help='commit to compare with (default: the one before head)')
+    cmp.add_argument('head', nargs='?', help='commit to compare (default: the latest)')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        for rows in args.rows:
+            record = benchmark(parse_rows(rows), args.products, args.classes, args.customers,
+                               args.months, args.seed, repeat=args.repeat, warm=args.warm,
+                               native_charts=args.native)
+            print('{} rows @ {}{}'.format(record['config']['rows'], record['commit'],
+                                          ' (dirty)' if record['dirty'] else ''))
+            for name, stage in record['stages'].items():
+                print('  {:<26} {:>9.3f}s wall {:>9.3f}s cpu'.format(name, stage['wall'], stage['cpu']))
+            print('  {:<26} {:>9.3f}s'.format('TOTAL', record['total']))
+    else:
+        config = config_key(parse_rows(args.rows), args.products, args.classes, args.customers,
+                            args.months, args.seed, args.warm, args.native)
+        try:
+            print(compare(config, args.base, args.head).to_string())
+        except ValueError as e:
+            parser.error(str(e))
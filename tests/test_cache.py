@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from ReportGen.cache import ColumnarCache
+
+
+def _workbook(path):
+    df = pd.DataFrame({
+        'TX_DATE': pd.to_datetime(['2021-03-01', '2021-03-01', '2021-03-02', '2021-03-05']),
+        'CUSTOMER_ID': [11, 12, 11, 13],
+        'PRODUCT_NAME': ['Soup', 'Wine', None, 'Soup'],
+        'PRICE': [2.5, 9.0, 4.0, 2.5],
+        'QTY': [1, 3, 2, 5],
+    })
+    df.to_excel(path, index=False, engine='openpyxl')
+    return pd.read_excel(path, engine='openpyxl')
+
+
+def _touch(path, seconds=10):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ColumnarCache(str(tmp_path / 'cache'))
+
+
+def test_read_stores_then_hits(tmp_path, cache):
+    path = str(tmp_path / 'tx_data_202103.xlsx')
+    expected = _workbook(path)
+    assert cache.lookup(path) is None
+    pd.testing.assert_frame_equal(cache.read_excel(path), expected)
+    assert cache.lookup(path) is not None
+    loaded = cache.load(path)
+    pd.testing.assert_frame_equal(loaded, expected)
+    assert list(loaded.dtypes.astype(str)) == [
+        'datetime64[ns]', 'int64', 'object', 'float64', 'int64']
+
+
+def test_categories_are_decoded_sorted(tmp_path, cache):
+    path = str(tmp_path / 'tx_data_202103.xlsx')
+    expected = _workbook(path)
+    cache.read_excel(path)
+    loaded = cache.load(path, categories=['PRODUCT_NAME'])
+    assert pd.api.types.is_categorical_dtype(loaded['PRODUCT_NAME'])
+    assert list(loaded['PRODUCT_NAME'].cat.categories) == ['Soup', 'Wine']
+    pd.testing.assert_series_equal(loaded['PRODUCT_NAME'].astype(object), expected['PRODUCT_NAME'])
+
+
+def test_touched_but_identical_file_hits(tmp_path, cache):
+    path = str(tmp_path / 'tx_data_202103.xlsx')
+    _workbook(path)
+    cache.read_excel(path)
+    _touch(path)
+    manifest = cache.lookup(path)
+    assert manifest is not None
+    # the new mtime is recorded, so the next lookup does not re-hash
+    assert manifest['mtime_ns'] == os.stat(path).st_mtime_ns
+    assert cache.lookup(path)['mtime_ns'] == manifest['mtime_ns']
+
+
+def test_changed_size_misses(tmp_path, cache):
+    path = str(tmp_path / 'tx_data_202103.xlsx')
+    _workbook(path)
+    cache.read_excel(path)
+    df = pd.read_excel(path, engine='openpyxl')
+    pd.concat([df, df]).to_excel(path, index=False, engine='openpyxl')
+    assert cache.lookup(path) is None
+    assert len(cache.read_excel(path)) == 2 * len(df)
+
+
+def test_same_size_rewrite_misses(tmp_path, cache):
+    path = str(tmp_path / 'data.bin')
+    with open(path, 'wb') as f:
+        f.write(b'a' * 64)
+    cache.store(path, pd.DataFrame({'X': [1]}))
+    with open(path, 'wb') as f:
+        f.write(b'b' * 64)
+    _touch(path)
+    assert cache.lookup(path) is None
+
+
+def test_filters_decode_only_matching_rows(tmp_path, cache):
+    path = str(tmp_path / 'tx_data_202103.xlsx')
+    expected = _workbook(path)
+    cache.read_excel(path)
+    filters = {'PRODUCT_NAME': {'Soup'}, 'QTY': lambda q: q > 1}
+    loaded = cache.load(path, filters=filters)
+    want = expected[(expected['PRODUCT_NAME'] == 'Soup') & (expected['QTY'] > 1)]
+    pd.testing.assert_frame_equal(loaded, want.reset_index(drop=True))
+    # the first read applies the same filters
+    cache.clear()
+    pd.testing.assert_frame_equal(cache.read_excel(path, filters=filters), want.reset_index(drop=True))
+    assert np.array_equal(cache.load(path)['QTY'], expected['QTY'])
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from ReportGen.engine import _EXACT_FLOAT, aggregate
+
+
+def _frame():
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({
+        'KEY': rng.choice(['a', 'b', 'c', 'd'], n),
+        'DAY': rng.integers(1, 8, n),
+        'QTY': rng.integers(-50, 50, n),
+        'COST': rng.normal(10, 5, n),
+    })
+    df.loc[rng.choice(n, 40, replace=False), 'KEY'] = None
+    df.loc[rng.choice(n, 40, replace=False), 'COST'] = np.nan
+    return df
+
+
+def _expected(df, key, cols, func):
+    return df.groupby(key)[cols].agg(func)
+
+
+@pytest.mark.parametrize('func', ['sum', 'mean', 'count'])
+@pytest.mark.parametrize('key', ['KEY', 'DAY', ['KEY', 'DAY']])
+def test_matches_groupby(key, func):
+    df = _frame()
+    cols = ['QTY', 'COST']
+    got = aggregate(df, [(key, cols, func)])[(tuple(key) if isinstance(key, list) else key, func)]
+    pd.testing.assert_frame_equal(got, _expected(df, key, cols, func),
+                                  check_dtype=False, check_names=False)
+
+
+def test_int_sums_stay_integers():
+    df = _frame()
+    got = aggregate(df, [('KEY', ['QTY'], 'sum')])[('KEY', 'sum')]
+    assert got['QTY'].dtype == np.int64
+
+
+def test_funcs_share_one_key():
+    df = _frame()
+    res = aggregate(df, [('KEY', ['COST'], 'sum'), ('KEY', ['COST', 'QTY'], 'count')])
+    pd.testing.assert_frame_equal(res[('KEY', 'count')], _expected(df, 'KEY', ['COST', 'QTY'], 'count'),
+                                  check_dtype=False)
+
+
+def test_count_of_non_numeric_column():
+    df = _frame()
+    df['NAME'] = df['KEY'].map({'a': 'x', 'b': None, 'c': 'z', 'd': 'w'})
+    got = aggregate(df, [('DAY', ['NAME'], 'count')])[('DAY', 'count')]
+    pd.testing.assert_frame_equal(got, _expected(df, 'DAY', ['NAME'], 'count'), check_dtype=False)
+
+
+def test_exact_integer_sums_beyond_float_precision():
+    big = _EXACT_FLOAT // 2 + 1
+    # max * rows >= 2 ** 53: summed exactly on sorted codes, not by bincount
+    df = pd.DataFrame({'KEY': ['a', 'a', 'a', 'b'],
+                       'V': np.array([big, big, 1, 3], dtype=np.int64)})
+    got = aggregate(df, [('KEY', ['V'], 'sum')])[('KEY', 'sum')]
+    assert got.loc['a', 'V'] == 2 * big + 1
+    assert got.loc['b', 'V'] == 3
+    pd.testing.assert_frame_equal(got, _expected(df, 'KEY', ['V'], 'sum'))
+
+
+def test_unsupported_aggfunc():
+    with pytest.raises(ValueError):
+        aggregate(_frame(), [('KEY', ['QTY'], 'median')])
@@ -0,0 +1,16 @@
+import os
+import pytest
+from ReportGen.startup import check_imports
+
+
+def test_light_modules_skip_heavy_imports():
+    # raises naming the module if any of them loads a plotting/deck library
+    check_imports(budget=None)
+
+
+# wall-clock import times depend on the machine and its load, so they are
+# checked only when REPORTGEN_IMPORT_BUDGET gives the seconds allowed
+@pytest.mark.skipif('REPORTGEN_IMPORT_BUDGET' not in os.environ,
+                    reason='set REPORTGEN_IMPORT_BUDGET to check import times')
+def test_light_modules_import_within_budget():
+    check_imports(budget=float(os.environ['REPORTGEN_IMPORT_BUDGET']))
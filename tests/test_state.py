@@ -0,0 +1,92 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+from ReportGen.prep import attach_mapper, compact_frame, concat_frames, consolidate_data, data_files, generate_features, read_workbook
+from ReportGen.state import COUNTS, GROUPINGS, Aggregates, AggregateState
+
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+MONTHS = ['tx_data_202101.xlsx', 'tx_data_202102.xlsx', 'tx_data_202103.xlsx']
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'data')
+    shutil.copy(os.path.join(SAMPLE_DIR, 'product_names_map.xlsx'), tmp_path / 'data')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _add(workdir, name, source=None):
+    shutil.copy(os.path.join(SAMPLE_DIR, source or name), workdir / 'data' / name)
+
+
+def _full(mapper):
+    # the whole dataset aggregated at once
+    df = concat_frames([read_workbook(p, compact=True) for p in data_files('tx_data_')])
+    df = compact_frame(attach_mapper(generate_features(df), mapper, compact=True))
+    return Aggregates.from_frame(df)
+
+
+def _assert_same(agg, expected):
+    for key in GROUPINGS:
+        pd.testing.assert_frame_equal(agg.sums[key].sort_index(), expected.sums[key].sort_index(),
+                                      check_dtype=False)
+    for key in COUNTS:
+        pd.testing.assert_frame_equal(agg.counts[key].sort_index(), expected.counts[key].sort_index(),
+                                      check_dtype=False)
+    pd.testing.assert_series_equal(agg.class_daily.sort_index(), expected.class_daily.sort_index(),
+                                   check_dtype=False)
+    pd.testing.assert_frame_equal(agg.cost_box(), expected.cost_box(), check_dtype=False)
+
+
+def _update(state, mapper):
+    ingested = state.update('tx_data_', mapper, workers=1)
+    state.save()
+    return ingested
+
+
+def test_incremental_state_matches_full_aggregates(workdir):
+    mapper = consolidate_data('map')
+    path = str(workdir / 'state.pkl')
+    for name in MONTHS[:2]:
+        _add(workdir, name)
+    state = AggregateState.load(path)
+    assert _update(state, mapper) == MONTHS[:2]
+    _assert_same(state.total, _full(mapper))
+
+    # a new month is folded into the saved total
+    _add(workdir, MONTHS[2])
+    state = AggregateState.load(path)
+    assert _update(state, mapper) == MONTHS[2:]
+    _assert_same(state.total, _full(mapper))
+    assert _update(AggregateState.load(path), mapper) == []
+
+    # a changed workbook is re-read and the total re-merged from the partials
+    _add(workdir, MONTHS[1], source='tx_data_202104.xlsx')
+    state = AggregateState.load(path)
+    assert _update(state, mapper) == MONTHS[1:2]
+    _assert_same(state.total, _full(mapper))
+
+    # a removed one is dropped from the total, its partial file too
+    os.remove(workdir / 'data' / MONTHS[0])
+    state = AggregateState.load(path)
+    assert _update(state, mapper) == []
+    _assert_same(AggregateState.load(path).total, _full(mapper))
+    assert sorted(os.listdir(workdir / 'partitions')) == [m + '.pkl' for m in MONTHS[1:]]
+
+
+def test_mapper_change_resets_state(workdir):
+    mapper = consolidate_data('map')
+    path = str(workdir / 'state.pkl')
+    for name in MONTHS:
+        _add(workdir, name)
+    _update(AggregateState.load(path), mapper)
+
+    mapper = mapper.copy()
+    mapper['PRODUCT_CLASS'] = mapper['PRODUCT_CLASS'].where(
+        mapper['PRODUCT_CLASS'] != mapper['PRODUCT_CLASS'].iloc[0], 'Renamed')
+    state = AggregateState.load(path)
+    assert _update(state, mapper) == MONTHS
+    _assert_same(state.total, _full(mapper))